@@ -0,0 +1,294 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from typing import Any, Callable
+import yaml
+from haus_utils import PluginConfig
+
+from hass import HassPlugin
+from hass.transformers import EntityTransformer, ActionTransformer
+from hass.models import ModelBuilder
+
+from .fake_hass import FakeHass
+from .fixtures import make_events, make_services, make_states
+
+MANIFEST = os.path.join(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__))), "plugin.yaml")
+
+
+def summarize(name: str, samples: list[float], items: int = 1, **extra: Any) -> dict[str, Any]:
+    # samples are seconds per operation, items is the work done per operation.
+    ordered = sorted(samples)
+
+    def percentile(p: float) -> float:
+        return ordered[min(len(ordered) - 1, int(round(p * (len(ordered) - 1))))]
+
+    total = sum(samples)
+    return {
+        "name": name,
+        "count": len(samples),
+        "mean_ms": statistics.fmean(samples) * 1000,
+        "p50_ms": percentile(0.5) * 1000,
+        "p95_ms": percentile(0.95) * 1000,
+        "p99_ms": percentile(0.99) * 1000,
+        "max_ms": ordered[-1] * 1000,
+        "items_per_sec": (len(samples) * items) / total if total > 0 else None,
+        **extra,
+    }
+
+
+def measure(func: Callable[[], Any], repeat: int) -> list[float]:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+async def ameasure(func: Callable[[], Any], repeat: int) -> list[float]:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def make_plugin(url: str, token: str, overrides: dict[str, Any]) -> HassPlugin:
+    with open(MANIFEST) as f:
+        config = PluginConfig(**yaml.safe_load(f))
+    return HassPlugin(config, {"hass_server": url, "hass_token": token, **overrides})
+
+
+def bench_transformers(scale: int, repeat: int) -> list[dict[str, Any]]:
+    states = make_states(scale)
+    services = make_services()
+    service_count = sum([len(i) for i in services.values()])
+    results = []
+
+    for trusted in [False, True]:
+        ModelBuilder.trusted = trusted
+        suffix = "[trusted]" if trusted else ""
+        EntityTransformer._plans.clear()
+        results.append(summarize(
+            "EntityTransformer.transform[cold]" + suffix,
+            measure(lambda: [EntityTransformer.transform(i)
+                    for i in states], 1),
+            items=len(states), scale=scale,
+        ))
+        results.append(summarize(
+            "EntityTransformer.transform" + suffix,
+            measure(lambda: [EntityTransformer.transform(i)
+                    for i in states], repeat),
+            items=len(states), scale=scale,
+        ))
+
+        def transform_actions():
+            return [
+                ActionTransformer.transform(domain, service, data)
+                for domain, entries in services.items()
+                for service, data in entries.items()
+            ]
+
+        ActionTransformer._services.clear()
+        ActionTransformer._fields.clear()
+        results.append(summarize(
+            "ActionTransformer.transform[cold]" + suffix,
+            measure(transform_actions, 1), items=service_count, scale=scale,
+        ))
+        results.append(summarize(
+            "ActionTransformer.transform" + suffix,
+            measure(transform_actions, repeat), items=service_count, scale=scale,
+        ))
+
+    ModelBuilder.trusted = False
+    return results
+
+
+async def bench_plugin(scale: int, repeat: int, event_count: int, overrides: dict[str, Any]) -> list[dict[str, Any]]:
+    states = make_states(scale)
+    services = make_services()
+    events = make_events(states, event_count)
+    results = []
+
+    async with FakeHass(states, services) as hass:
+        plugin = make_plugin(hass.url, hass.token, overrides)
+        results.append(summarize("initialize", await ameasure(plugin.initialize, 1), scale=scale))
+
+        results.append(summarize(
+            "get_entities", await ameasure(plugin.get_entities, repeat),
+            items=scale, scale=scale,
+        ))
+        ids = [i["entity_id"] for i in states[::max(1, scale // 50)]]
+        results.append(summarize(
+            "get_entities[ids]", await ameasure(lambda: plugin.get_entities(ids=ids), repeat),
+            items=len(ids), scale=scale,
+        ))
+        results.append(summarize(
+            "get_actions[cold]", await ameasure(plugin.get_actions, 1), scale=scale,
+        ))
+        results.append(summarize(
+            "get_actions", await ameasure(plugin.get_actions, repeat), scale=scale,
+        ))
+        results.append(summarize(
+            "call_action",
+            await ameasure(lambda: plugin.call_action("light.turn_on", states[0]["entity_id"], {"brightness": 128}), repeat * 10),
+            scale=scale,
+        ))
+
+        sent: dict[str, float] = {}
+        lag: list[float] = []
+        received = 0
+
+        async def consume():
+            nonlocal received
+            async for event in plugin.listen_events():
+                if event == None or not "state_changed" in event.types:
+                    continue
+                received += 1
+                context = ((event.data or {}).get(
+                    "new_state") or {}).get("context") or {}
+                if context.get("id") in sent:
+                    lag.append(time.perf_counter() - sent[context["id"]])
+
+        consumer = asyncio.create_task(consume())
+        await asyncio.wait_for(hass.subscribed.wait(), 30)
+        start = time.perf_counter()
+        for event in events:
+            sent[event["data"]["new_state"]["context"]["id"]] = time.perf_counter()
+            await hass.fire(event)
+
+        # Coalescing or filtering settings may legitimately drop events, so
+        # stop once the stream has been quiet for a second.
+        last, idle = -1, time.perf_counter()
+        while received < len(events) and time.perf_counter() - idle < 1:
+            if received != last:
+                last, idle = received, time.perf_counter()
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - start
+        consumer.cancel()
+        await asyncio.gather(consumer, return_exceptions=True)
+        # Delta events do not carry the HA context, so lag is only sampled
+        # for full events.
+        stream = {"sent": len(events), "received": received,
+                  "events_per_sec": received / elapsed}
+        if len(lag) > 0:
+            results.append(summarize(
+                "listen_events[lag]", lag, scale=scale, **stream))
+        else:
+            results.append({"name": "listen_events", "scale": scale, **stream})
+
+        await plugin.close()
+    return results
+
+
+async def watch_loop(interval: float, samples: list[float], stop: asyncio.Event):
+    # How late the loop wakes a sleeper, which is the time it spent blocked.
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, time.perf_counter() - start - interval))
+
+
+async def bench_stall(scale: int, repeat: int, modes: list[str], overrides: dict[str, Any]) -> list[dict[str, Any]]:
+    # Loop stall while get_entities and an action refresh transform
+    # everything from cold caches, for each transform_mode.
+    states = make_states(scale)
+    services = make_services()
+    results = []
+
+    async with FakeHass(states, services) as hass:
+        for mode in modes:
+            plugin = make_plugin(hass.url, hass.token, {
+                                 **overrides, "transform_mode": mode})
+            await plugin.initialize()
+            stalls: list[float] = []
+            durations: list[float] = []
+            for _ in range(repeat):
+                EntityTransformer._plans.clear()
+                ActionTransformer._services.clear()
+                ActionTransformer._fields.clear()
+                for hub in plugin.hubs.values():
+                    hub.mirror.entities.clear()
+                    hub.catalog.actions = {}
+
+                stop = asyncio.Event()
+                watcher = asyncio.create_task(watch_loop(0.001, stalls, stop))
+                await asyncio.sleep(0.01)
+                start = time.perf_counter()
+                await asyncio.gather(plugin.get_entities(), plugin.refresh_actions())
+                durations.append(time.perf_counter() - start)
+                stop.set()
+                await watcher
+
+            results.append(summarize(
+                "loop_stall[" + mode + "]", stalls, scale=scale,
+                transform_ms=statistics.fmean(durations) * 1000,
+            ))
+            await plugin.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks", description="Offline HassPlugin benchmarks against a fake Home Assistant server")
+    parser.add_argument("--scales", type=int, nargs="+",
+                        default=[1000, 10000, 50000], help="entity counts to benchmark")
+    parser.add_argument("--events", type=int, default=5000,
+                        help="state_changed events per burst")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="repetitions per measurement")
+    parser.add_argument("--settings", type=json.loads, default={},
+                        help="JSON object of extra HassPluginSettings")
+    parser.add_argument("--skip-plugin", action="store_true")
+    parser.add_argument("--skip-micro", action="store_true")
+    parser.add_argument("--stall-modes", nargs="+", default=["inline", "yield", "thread", "process"],
+                        help="transform modes to measure event loop stalls for")
+    parser.add_argument("--skip-stall", action="store_true")
+    parser.add_argument("--output", help="write JSON results to this file")
+    args = parser.parse_args()
+
+    results = []
+    for scale in args.scales:
+        if not args.skip_micro:
+            results.extend(bench_transformers(scale, args.repeat))
+        if not args.skip_plugin:
+            results.extend(asyncio.run(bench_plugin(
+                scale, args.repeat, args.events, args.settings)))
+        if not args.skip_stall:
+            results.extend(asyncio.run(bench_stall(
+                scale, args.repeat, args.stall_modes, args.settings)))
+        for result in results:
+            if result["scale"] == scale and "mean_ms" in result:
+                print("{scale:>7} {name:<40} mean {mean_ms:>10.3f} ms  p95 {p95_ms:>10.3f} ms".format(
+                    **result), file=sys.stderr)
+            elif result["scale"] == scale:
+                print("{scale:>7} {name:<40} {events_per_sec:>10.1f} events/s".format(
+                    **result), file=sys.stderr)
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.time(),
+            "settings": args.settings,
+            "events": args.events,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
+    else:
+        json.dump(report, sys.stdout, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+import asyncio
+import datetime
+import json
+from typing import Any, Optional
+import websockets
+
+
+class FakeHass:
+    HA_VERSION = "2024.1.0"
+
+    def __init__(self, states: list[dict[str, Any]], services: dict[str, dict[str, Any]], token: str = "bench-token"):
+        self.states = states
+        self.services = services
+        self.token = token
+        self.calls: list[dict[str, Any]] = []
+        self.requests: dict[str, int] = {}
+        self.subscriptions: dict[Any, dict[int, Optional[str]]] = {}
+        self.subscribed = asyncio.Event()
+        self._server = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.sockets[0].getsockname()[:2]
+        return "ws://" + host + ":" + str(port) + "/api/websocket"
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        self._server = await websockets.serve(self.handler, host, port, max_size=None)
+        return self.url
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.stop()
+
+    async def handler(self, ws, *args):
+        await ws.send(json.dumps({"type": "auth_required", "ha_version": self.HA_VERSION}))
+        auth = json.loads(await ws.recv())
+        if auth.get("type") != "auth" or auth.get("access_token") != self.token:
+            await ws.send(json.dumps({"type": "auth_invalid", "message": "Invalid access token or password"}))
+            await ws.close()
+            return
+        await ws.send(json.dumps({"type": "auth_ok", "ha_version": self.HA_VERSION}))
+
+        self.subscriptions[ws] = {}
+        try:
+            async for raw in ws:
+                await self.dispatch(ws, json.loads(raw))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            del self.subscriptions[ws]
+
+    async def dispatch(self, ws, message: dict[str, Any]):
+        mid = message.get("id")
+        mtype = message.get("type")
+        self.requests[mtype] = self.requests.get(mtype, 0) + 1
+        match mtype:
+            case "get_states":
+                await self.result(ws, mid, self.states)
+            case "get_services":
+                await self.result(ws, mid, self.services)
+            case "get_config":
+                await self.result(ws, mid, {"version": self.HA_VERSION})
+            case "subscribe_events":
+                self.subscriptions[ws][mid] = message.get("event_type")
+                await self.result(ws, mid, None)
+                self.subscribed.set()
+            case "unsubscribe_events":
+                self.subscriptions[ws].pop(message.get("subscription"), None)
+                await self.result(ws, mid, None)
+            case "call_service":
+                self.calls.append(message)
+                await self.result(ws, mid, {"context": {"id": str(mid), "parent_id": None, "user_id": None}})
+            case "supported_features":
+                await self.result(ws, mid, None)
+            case "ping":
+                await ws.send(json.dumps({"id": mid, "type": "pong"}))
+            case _:
+                await ws.send(json.dumps({
+                    "id": mid,
+                    "type": "result",
+                    "success": False,
+                    "error": {"code": "unknown_command", "message": "Unknown command."},
+                }))
+
+    async def result(self, ws, mid: int, result: Any):
+        await ws.send(json.dumps({"id": mid, "type": "result", "success": True, "result": result}))
+
+    async def fire(self, event: dict[str, Any]):
+        event = {**event, "time_fired": datetime.datetime.now(
+            datetime.timezone.utc).isoformat()}
+        for ws, subscriptions in list(self.subscriptions.items()):
+            for sid, event_type in list(subscriptions.items()):
+                if event_type == None or event_type == event["event_type"]:
+                    try:
+                        await ws.send(json.dumps({"id": sid, "type": "event", "event": event}))
+                    except websockets.ConnectionClosed:
+                        pass
+
+    async def burst(self, events: list[dict[str, Any]], rate: float = 0):
+        # rate is in events per second, 0 sends as fast as the socket allows.
+        for event in events:
+            await self.fire(event)
+            if rate > 0:
+                await asyncio.sleep(1 / rate)
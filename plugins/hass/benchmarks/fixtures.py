@@ -0,0 +1,256 @@
+import datetime
+import random
+import uuid
+from typing import Any
+
+# Relative share of each domain in a generated install, roughly matching a
+# sensor-heavy Home Assistant setup.
+DOMAIN_WEIGHTS = {
+    "sensor": 45,
+    "binary_sensor": 15,
+    "light": 10,
+    "switch": 8,
+    "climate": 2,
+    "media_player": 3,
+    "device_tracker": 5,
+    "cover": 3,
+    "weather": 1,
+    "update": 6,
+    "person": 1,
+    "select": 1,
+}
+
+SENSOR_KINDS = [
+    ("temperature", "°C", lambda r: round(r.uniform(15, 30), 1)),
+    ("humidity", "%", lambda r: round(r.uniform(20, 80), 1)),
+    ("power", "W", lambda r: round(r.uniform(0, 3500), 2)),
+    ("energy", "kWh", lambda r: round(r.uniform(0, 20000), 3)),
+    ("battery", "%", lambda r: r.randint(0, 100)),
+    ("illuminance", "lx", lambda r: r.randint(0, 1000)),
+    ("timestamp", None, lambda r: iso_time(r)),
+    (None, None, lambda r: r.choice(["idle", "running", "unavailable", "unknown"])),
+]
+
+
+def iso_time(r: random.Random) -> str:
+    base = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    return (base + datetime.timedelta(seconds=r.randint(0, 30_000_000))).isoformat()
+
+
+def context() -> dict[str, Any]:
+    return {"id": uuid.uuid4().hex, "parent_id": None, "user_id": None}
+
+
+def make_attributes(r: random.Random, domain: str, name: str) -> tuple[Any, dict[str, Any]]:
+    attributes: dict[str, Any] = {"friendly_name": name.replace("_", " ").title()}
+    match domain:
+        case "sensor":
+            device_class, unit, value = r.choice(SENSOR_KINDS)
+            if device_class:
+                attributes["device_class"] = device_class
+            if unit:
+                attributes["unit_of_measurement"] = unit
+                attributes["state_class"] = "measurement"
+            return str(value(r)), attributes
+        case "binary_sensor":
+            attributes["device_class"] = r.choice(
+                ["motion", "door", "window", "occupancy", "connectivity"])
+            return r.choice(["on", "off"]), attributes
+        case "light":
+            attributes.update({
+                "supported_color_modes": ["color_temp", "hs", "xy"],
+                "color_mode": "hs",
+                "brightness": r.randint(0, 255),
+                "hs_color": [round(r.uniform(0, 360), 1), round(r.uniform(0, 100), 1)],
+                "rgb_color": [r.randint(0, 255) for _ in range(3)],
+                "xy_color": [round(r.random(), 3), round(r.random(), 3)],
+                "min_mireds": 153,
+                "max_mireds": 500,
+                "effect_list": ["none", "colorloop", "random"],
+                "supported_features": 44,
+            })
+            return r.choice(["on", "off"]), attributes
+        case "switch":
+            attributes["assumed_state"] = r.random() > 0.8
+            return r.choice(["on", "off"]), attributes
+        case "climate":
+            attributes.update({
+                "hvac_modes": ["off", "heat", "cool", "auto"],
+                "min_temp": 7,
+                "max_temp": 35,
+                "current_temperature": round(r.uniform(15, 28), 1),
+                "temperature": round(r.uniform(18, 24), 1),
+                "hvac_action": r.choice(["idle", "heating", "cooling"]),
+                "preset_modes": ["home", "away", "eco"],
+                "preset_mode": "home",
+                "supported_features": 401,
+            })
+            return r.choice(["heat", "cool", "auto", "off"]), attributes
+        case "media_player":
+            attributes.update({
+                "volume_level": round(r.random(), 2),
+                "is_volume_muted": False,
+                "media_content_type": "music",
+                "media_title": "Track " + str(r.randint(1, 999)),
+                "media_artist": "Artist " + str(r.randint(1, 99)),
+                "source_list": ["Spotify", "Radio", "TV"],
+                "entity_picture": "/api/media_player_proxy/" + name,
+                "supported_features": 152463,
+            })
+            return r.choice(["playing", "paused", "idle", "off"]), attributes
+        case "device_tracker":
+            attributes.update({
+                "source_type": "gps",
+                "latitude": round(r.uniform(-90, 90), 6),
+                "longitude": round(r.uniform(-180, 180), 6),
+                "gps_accuracy": r.randint(5, 100),
+                "battery_level": r.randint(0, 100),
+            })
+            return r.choice(["home", "not_home"]), attributes
+        case "cover":
+            attributes.update({
+                "current_position": r.randint(0, 100),
+                "device_class": "garage",
+                "supported_features": 15,
+            })
+            return r.choice(["open", "closed", "opening"]), attributes
+        case "weather":
+            attributes.update({
+                "temperature": round(r.uniform(-5, 30), 1),
+                "humidity": r.randint(20, 100),
+                "pressure": round(r.uniform(990, 1030), 1),
+                "wind_speed": round(r.uniform(0, 40), 1),
+                "forecast": [
+                    {
+                        "datetime": iso_time(r),
+                        "condition": r.choice(["sunny", "rainy", "cloudy"]),
+                        "temperature": round(r.uniform(-5, 30), 1),
+                        "precipitation": round(r.uniform(0, 10), 1),
+                    }
+                    for _ in range(7)
+                ],
+            })
+            return r.choice(["sunny", "rainy", "cloudy"]), attributes
+        case "update":
+            attributes.update({
+                "installed_version": "1.0." + str(r.randint(0, 9)),
+                "latest_version": "1.0." + str(r.randint(0, 9)),
+                "release_url": "https://example.com/releases",
+                "auto_update": False,
+                "in_progress": False,
+                "skipped_version": None,
+            })
+            return r.choice(["on", "off"]), attributes
+        case "person":
+            attributes.update({
+                "user_id": uuid.uuid4().hex,
+                "device_trackers": ["device_tracker.phone_" + name],
+            })
+            return r.choice(["home", "not_home"]), attributes
+        case _:
+            attributes["options"] = ["low", "medium", "high"]
+            return r.choice(attributes["options"]), attributes
+
+
+def make_state(r: random.Random, entity_id: str, name: str) -> dict[str, Any]:
+    state, attributes = make_attributes(r, entity_id.split(".")[0], name)
+    timestamp = iso_time(r)
+    return {
+        "entity_id": entity_id,
+        "state": state,
+        "attributes": attributes,
+        "last_changed": timestamp,
+        "last_updated": timestamp,
+        "context": context(),
+    }
+
+
+def make_states(count: int, seed: int = 0) -> list[dict[str, Any]]:
+    r = random.Random(seed)
+    domains = list(DOMAIN_WEIGHTS.keys())
+    weights = list(DOMAIN_WEIGHTS.values())
+    states = []
+    for index in range(count):
+        domain = r.choices(domains, weights)[0]
+        name = "device_" + str(index)
+        states.append(make_state(r, domain + "." + name, name))
+    return states
+
+
+def make_services(integrations: int = 40, seed: int = 0) -> dict[str, dict[str, Any]]:
+    r = random.Random(seed)
+    light_fields = {
+        "transition": {"name": "Transition", "description": "Duration it takes to get to next state.", "example": 60, "selector": {"number": {"min": 0, "max": 300, "unit_of_measurement": "seconds"}}},
+        "rgb_color": {"name": "Color", "description": "The color in RGB format.", "example": "[255, 100, 100]", "selector": {"color_rgb": None}},
+        "color_temp": {"name": "Color temperature", "description": "Color temperature in mireds.", "selector": {"color_temp": {"min_mireds": 153, "max_mireds": 500}}},
+        "brightness": {"name": "Brightness value", "description": "Number indicating brightness.", "advanced": True, "selector": {"number": {"min": 0, "max": 255}}},
+        "effect": {"name": "Effect", "description": "Light effect.", "selector": {"text": None}},
+        "flash": {"name": "Flash", "description": "Tell light to flash.", "selector": {"select": {"options": ["long", "short"]}}},
+    }
+    services: dict[str, dict[str, Any]] = {
+        "light": {
+            "turn_on": {"name": "Turn on", "description": "Turn on one or more lights.", "fields": light_fields, "target": {"entity": [{"domain": ["light"]}]}},
+            "turn_off": {"name": "Turn off", "description": "Turn off one or more lights.", "fields": {"transition": light_fields["transition"], "flash": light_fields["flash"]}, "target": {"entity": [{"domain": ["light"]}]}},
+            "toggle": {"name": "Toggle", "description": "Toggle one or more lights.", "fields": light_fields, "target": {"entity": [{"domain": ["light"]}]}},
+        },
+        "homeassistant": {
+            "restart": {"name": "Restart", "description": "Restart Home Assistant.", "fields": {}},
+            "reload_all": {"name": "Reload all", "description": "Reload all YAML configuration.", "fields": {}},
+            "update_entity": {"name": "Update entity", "description": "Force one or more entities to update.", "fields": {"entity_id": {"name": "Entities", "required": True, "selector": {"entity": {"multiple": True}}}}},
+        },
+        "notify": {
+            "persistent_notification": {"name": "Send a persistent notification", "description": "", "fields": {"message": {"name": "Message", "required": True, "example": "The garage door has been open for 10 minutes.", "selector": {"text": None}}, "title": {"name": "Title", "selector": {"text": None}}}},
+        },
+        "scene": {
+            "turn_on": {"name": "", "description": "Activate a scene.", "fields": {"transition": light_fields["transition"]}, "target": {"entity": [{"domain": ["scene"]}]}},
+        },
+        "climate": {
+            "set_temperature": {"name": "Set target temperature", "description": "Set target temperature.", "fields": {"temperature": {"name": "Temperature", "selector": {"number": {"min": 0, "max": 250, "step": 0.1}}}, "hvac_mode": {"name": "HVAC mode", "selector": {"select": {"options": [{"label": "Off", "value": "off"}, {"label": "Heat", "value": "heat"}, {"label": "Cool", "value": "cool"}]}}}}, "target": {"entity": [{"domain": ["climate"]}]}},
+        },
+        "conversation": {
+            "process": {"name": "Process", "description": "Launch a conversation.", "fields": {"text": {"name": "Text", "required": True, "selector": {"text": None}}, "agent_id": {"name": "Agent", "selector": {"conversation_agent": None}}}},
+        },
+    }
+    for index in range(integrations):
+        domain = "integration_" + str(index)
+        services[domain] = {
+            "reload": {"name": "Reload", "description": "Reload the integration.", "fields": {}},
+            "set_value": {
+                "name": "Set value",
+                "description": "Set a value on a device.",
+                "fields": {
+                    "value": {"name": "Value", "required": True, "selector": {"number": {"min": 0, "max": r.randint(10, 1000)}}},
+                    "mode": {"name": "Mode", "selector": {"select": {"options": ["auto", "manual", "eco_mode"]}}},
+                    "enabled": {"name": "Enabled", "selector": {"boolean": None}},
+                    "at": {"name": "At", "selector": {"time": None}},
+                    "payload": {"name": "Payload", "advanced": True, "selector": {"object": None}},
+                    "entity": {"name": "Entity", "selector": {"entity": {"domain": "sensor"}}},
+                    "transition": light_fields["transition"],
+                    "constant": {"selector": {"constant": {"value": True}}},
+                },
+                "target": {"entity": [{"domain": [domain]}]},
+            },
+        }
+    return services
+
+
+def make_events(states: list[dict[str, Any]], count: int, seed: int = 0) -> list[dict[str, Any]]:
+    # A burst is dominated by a small set of chatty entities, the way power
+    # meters and presence sensors dominate a real event stream.
+    r = random.Random(seed)
+    chatty = r.sample(states, min(len(states), max(1, len(states) // 50)))
+    current = {i["entity_id"]: i for i in chatty}
+    events = []
+    for _ in range(count):
+        old = current[r.choice(chatty)["entity_id"]]
+        new = make_state(r, old["entity_id"], old["entity_id"].split(".")[1])
+        new["attributes"] = {**old["attributes"], **
+                             {k: v for k, v in new["attributes"].items() if r.random() < 0.2}}
+        current[new["entity_id"]] = new
+        events.append({
+            "event_type": "state_changed",
+            "data": {"entity_id": new["entity_id"], "old_state": old, "new_state": new},
+            "origin": "LOCAL",
+            "context": new["context"],
+        })
+    return events
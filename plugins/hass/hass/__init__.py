@@ -1,17 +1,112 @@
-from collections.abc import AsyncGenerator
-from secrets import token_urlsafe
+import asyncio
+import datetime
+import json
+import logging
+import time
+from collections.abc import AsyncGenerator, Awaitable
+from itertools import chain
 from typing import Any, Optional, Self
 from haus_utils import Plugin, PluginConfig, PluginEntity, EntityAction, PluginEvent
-from pydantic import BaseModel
-from hass_websocket_client import HassWS
-from hass_websocket_client.client import HassEventListener, HassEvent, HassEntity
+from pydantic import BaseModel, ValidationError, field_validator, model_validator
+from hass_websocket_client.client import HassEvent, HassEntity
 
-from .transformers import EntityTransformer, ActionTransformer
+from .transformers import EntityTransformer
+from .batch import ActionCall, ActionResult, group_calls
+from .filters import EventFilter
+from .streams import fair_merge
+from .coalesce import EventCoalescer, OverflowPolicy
+from .metrics import metrics
+from .models import ModelBuilder
+from .replay import EventLog
+from .hub import HassHub
+from .history import HistoryCache
+from .executor import TransformExecutor, TransformMode
+
+logger = logging.getLogger(__name__)
 
 
 class HassPluginSettings(BaseModel):
     hass_server: str
     hass_token: str
+    resync_interval: float = 300
+    delta_events: bool = False
+    action_concurrency: int = 8
+    event_types: list[str] = []
+    entity_filter: list[str] = []
+    domain_filter: list[str] = []
+    coalesce_window: float = 0
+    coalesce_domains: dict[str, float] = {}
+    coalesce_bypass: list[str] = ["unavailable", "unknown"]
+    event_queue_size: int = 1000
+    event_overflow: OverflowPolicy = "block"
+    metrics_enabled: bool = False
+    metrics_interval: float = 0
+    snapshot_path: str = ""
+    command_connections: int = 2
+    entity_chunk_size: int = 500
+    trusted_models: bool = False
+    plan_cache_size: int = 65536
+    replay_buffer_size: int = 1000
+    server_timeout: float = 10
+    history_enabled: bool = False
+    history_size: int = 256
+    history_duration: float = 0
+    history_domains: list[str] = ["sensor"]
+    auto_reconnect: bool = True
+    reconnect_delay: float = 1
+    reconnect_max_delay: float = 60
+    transform_mode: TransformMode = "inline"
+    transform_chunk_size: int = 100
+    transform_workers: int = 0
+
+    @field_validator("event_types", "entity_filter", "domain_filter", "coalesce_bypass", "history_domains", mode="before")
+    @classmethod
+    def split_list(cls, value: Any) -> Any:
+        if type(value) == str:
+            return [i.strip() for i in value.split(",") if len(i.strip()) > 0]
+        return value if value != None else []
+
+    @field_validator("coalesce_domains", mode="before")
+    @classmethod
+    def split_mapping(cls, value: Any) -> Any:
+        if type(value) == str:
+            return {
+                k.strip(): v.strip()
+                for k, _, v in [i.partition("=") for i in value.split(",")]
+                if len(k.strip()) > 0
+            }
+        return value if value != None else {}
+
+    @model_validator(mode="after")
+    def check_servers(self) -> Self:
+        self.servers()
+        return self
+
+    def servers(self) -> dict[str, tuple[str, str]]:
+        # hass_server is either a single address or "name=address" pairs for
+        # several servers, hass_token a shared token or "name=token" pairs.
+        # Only named servers get their ids namespaced.
+        servers: dict[str, str] = {}
+        for entry in [i.strip() for i in self.hass_server.split(",") if len(i.strip()) > 0]:
+            name, sep, address = entry.partition("=")
+            if not sep or "/" in name or ":" in name:
+                name, address = "", entry
+            if name.strip() in servers or (len(servers) > 0 and (name == "" or "" in servers)):
+                raise ValueError("Several servers need distinct names")
+            servers[name.strip()] = address.strip()
+        if len(servers) == 0:
+            raise ValueError("No server configured")
+
+        entries = [i.strip() for i in self.hass_token.split(",") if len(i.strip()) > 0]
+        if len(entries) > 0 and all(["=" in i for i in entries]):
+            tokens = {k.strip(): v.strip() for k, _, v in [i.partition("=") for i in entries]}
+        else:
+            tokens = {k: self.hass_token.strip() for k in servers.keys()}
+
+        missing = [k for k in servers.keys() if not tokens.get(k)]
+        if len(missing) > 0:
+            raise ValueError("No token for " + ", ".join(missing))
+        return {k: (v, tokens[k]) for k, v in servers.items()}
 
 
 class HassPlugin(Plugin):
@@ -20,61 +115,490 @@ class HassPlugin(Plugin):
     def __init__(self, config: PluginConfig, settings: HassPluginSettings):
         super().__init__(config, settings)
         self.settings = HassPluginSettings(**settings)
-        self.client: HassWS = None
+        self.executor = TransformExecutor(
+            mode=self.settings.transform_mode,
+            chunk_size=self.settings.transform_chunk_size,
+            workers=self.settings.transform_workers
+        )
+        self.hubs: dict[str, HassHub] = {
+            name: HassHub(
+                name,
+                server,
+                token,
+                namespace=name + ":" if name else "",
+                resync_interval=self.settings.resync_interval,
+                pool_size=self.settings.command_connections,
+                snapshot_path=self.settings.snapshot_path + "." + name if name and self.settings.snapshot_path else self.settings.snapshot_path,
+                timeout=self.settings.server_timeout,
+                history=HistoryCache(
+                    size=self.settings.history_size,
+                    duration=self.settings.history_duration,
+                    domains=self.settings.history_domains
+                ) if self.settings.history_enabled else None,
+                reconnect=self.settings.auto_reconnect,
+                reconnect_delay=self.settings.reconnect_delay,
+                reconnect_max_delay=self.settings.reconnect_max_delay,
+                executor=self.executor,
+            )
+            for name, (server, token) in self.settings.servers().items()
+        }
+        self.filter = EventFilter(
+            self.settings.event_types,
+            self.settings.entity_filter,
+            self.settings.domain_filter
+        )
+        self._metrics_task: Optional[asyncio.Task] = None
+        metrics.enabled = self.settings.metrics_enabled
+        ModelBuilder.trusted = self.settings.trusted_models
+        EntityTransformer.PLAN_CACHE_SIZE = max(1, self.settings.plan_cache_size)
+        self.log = EventLog(size=self.settings.replay_buffer_size)
+        self._producer: Optional[asyncio.Task] = None
+
+    @property
+    def namespaced(self) -> bool:
+        return not "" in self.hubs
+
+    def _route(self, id: str) -> tuple[Optional[HassHub], str]:
+        if not self.namespaced:
+            return self.hubs[""], id
+        name, sep, local = id.partition(":")
+        return self.hubs.get(name) if sep else None, local
+
+    def _group(self, ids: Optional[list[str]]) -> dict[HassHub, Optional[list[str]]]:
+        if ids == None:
+            return {i: None for i in self.hubs.values()}
+        grouped: dict[HassHub, list[str]] = {}
+        for i in ids:
+            hub, local = self._route(i)
+            if hub:
+                grouped.setdefault(hub, []).append(local)
+        return grouped
+
+    async def _gather(self, calls: dict[HassHub, Awaitable[Any]]) -> list[Any]:
+        # Hubs run concurrently. One that fails is logged and left out, the
+        # error only surfaces if no hub succeeded.
+        results = await asyncio.gather(*calls.values(), return_exceptions=True)
+        output = []
+        errors = []
+        for hub, result in zip(calls.keys(), results):
+            if isinstance(result, Exception):
+                logger.warning("HASS server %s failed: %r", hub.server, result)
+                errors.append(result)
+            elif isinstance(result, BaseException):
+                raise result
+            else:
+                output.append(result)
+        if len(output) == 0 and len(errors) > 0:
+            raise errors[0]
+        return output
 
     async def initialize(self):
-        self.client = await HassWS(self.settings.hass_server, self.settings.hass_token)
+        with metrics.timer("plugin.initialize"):
+            await self._gather({
+                hub: asyncio.wait_for(hub.initialize(), self.settings.server_timeout if self.settings.server_timeout > 0 else None)
+                for hub in self.hubs.values()
+            })
+
+        if metrics.enabled and self.settings.metrics_interval > 0:
+            self._metrics_task = asyncio.create_task(self._dump_metrics())
+
+        # The event stream keeps the mirror and history current, so it runs
+        # from the start rather than only once someone listens.
+        self._start_producer()
+
+    async def resync(self, emit: bool = False) -> bool:
+        return all(await self._gather({hub: hub.resync(emit=emit) for hub in self.hubs.values()}))
+
+    async def refresh_actions(self) -> bool:
+        return all(await self._gather({hub: hub.refresh_actions() for hub in self.hubs.values()}))
 
     async def close(self):
-        if self.client:
-            await self.client.close()
-            self.client = None
+        if self._producer:
+            self._producer.cancel()
+            await asyncio.gather(self._producer, return_exceptions=True)
+            self._producer = None
+
+        if self._metrics_task:
+            self._metrics_task.cancel()
+            await asyncio.gather(self._metrics_task, return_exceptions=True)
+            self._metrics_task = None
+
+        await asyncio.gather(*[i.close() for i in self.hubs.values()], return_exceptions=True)
+        self.executor.close()
+
+    def get_metrics(self) -> dict[str, Any]:
+        return metrics.snapshot()
+
+    async def _dump_metrics(self):
+        while True:
+            await asyncio.sleep(self.settings.metrics_interval)
+            logger.info("HASS plugin metrics: %s",
+                        json.dumps(metrics.snapshot()))
 
     async def get_entities(self, ids: list[str] = None) -> list[PluginEntity]:
-        result = await self.client.fetch_states()
-        if not result.success:
-            return []
+        with metrics.timer("plugin.get_entities"):
+            grouped = self._group(ids)
+            if len(grouped) == 1:
+                hub, local = next(iter(grouped.items()))
+                return await hub.get_entities(local)
+
+            results = await self._gather({hub: hub.get_entities(local) for hub, local in grouped.items()})
+            if ids == None:
+                return list(chain.from_iterable(results))
+            entities = {i.id: i for i in chain.from_iterable(results)}
+            return [entities[i] for i in dict.fromkeys(ids) if i in entities]
 
-        return [
-            EntityTransformer.transform(i)
-            for i in result.data
-            if ids == None or i["entity_id"] in ids
-        ]
+    async def iter_entities(self, ids: list[str] = None, chunk_size: int = None) -> AsyncGenerator[list[PluginEntity], Any]:
+        grouped = self._group(ids)
+        for hub, local in grouped.items():
+            try:
+                await hub.ensure_states()
+            except Exception:
+                if len(grouped) == 1:
+                    raise
+                logger.warning("HASS server %s failed", hub.server, exc_info=True)
+                continue
+
+            async for chunk in hub.chunks(local, chunk_size or self.settings.entity_chunk_size):
+                yield chunk
+
+    async def query_entities(
+        self,
+        domain: str | list[str] = None,
+        device_class: str | list[str] = None,
+        unit: str | list[str] = None,
+        state: str | list[str] = None,
+    ) -> list[PluginEntity]:
+        with metrics.timer("plugin.query_entities"):
+            return list(chain.from_iterable(await self._gather({
+                hub: hub.query_entities(domain=domain, device_class=device_class, unit=unit, state=state)
+                for hub in self.hubs.values()
+            })))
 
     async def get_actions(self, ids: list[str] = None) -> list[EntityAction]:
-        result = await self.client.fetch_services()
-        if not result.success:
-            return []
+        with metrics.timer("plugin.get_actions"):
+            grouped = self._group(ids)
+            if len(grouped) == 1:
+                hub, local = next(iter(grouped.items()))
+                return await hub.get_actions(local)
 
-        output = []
-        for domain, services in result.data.items():
-            for service, data in services.items():
-                if ids == None or (domain + "." + service) in ids:
-                    output.append(ActionTransformer.transform(
-                        domain, service, data))
+            results = await self._gather({hub: hub.get_actions(local) for hub, local in grouped.items()})
+            if ids == None:
+                return list(chain.from_iterable(results))
+            actions = {i.id: i for i in chain.from_iterable(results)}
+            return [actions[i] for i in dict.fromkeys(ids) if i in actions]
 
-        return output
+    async def get_history(self, property_ids: list[str] = None, since: datetime.datetime | float = None) -> dict[str, list[tuple[float, float]]]:
+        # (timestamp, value) samples of numeric properties, oldest first.
+        if isinstance(since, datetime.datetime):
+            since = since.timestamp()
+        history = {}
+        for hub, local in self._group(property_ids).items():
+            if hub.history:
+                history.update({
+                    hub.namespace + k: v for k, v in hub.history.get(local, since).items()})
+        return history
+
+    def _route_call(self, call: ActionCall) -> tuple[Optional[HassHub], ActionCall]:
+        hub, action_id = self._route(call.action_id)
+        target_hub, target = self._route(call.target) if call.target else (hub, None)
+        if hub == None or target_hub is not hub:
+            return None, call
+        if action_id == call.action_id and target == call.target:
+            return hub, call
+        return hub, ActionCall(action_id=action_id, target=target, fields=call.fields)
 
     async def call_action(self, action_id: str, target: Optional[str], fields: dict[str, Any]):
-        await self.client.call_service(
-            action_id.split(".")[0],
-            action_id.split(".")[1],
-            target={"entity_id": target} if target else {},
-            data={k: v for k, v in fields.items() if v != None}
-        )
+        hub, call = self._route_call(ActionCall(action_id=action_id, target=target, fields=fields))
+        if hub == None:
+            raise ValueError("No server for " + action_id)
+
+        domain, _, service = call.action_id.partition(".")
+        with metrics.timer("plugin.call_action"), metrics.timer("ws.call_service"):
+            await hub.connection().call_service(
+                domain,
+                service,
+                target={"entity_id": call.target} if call.target else {},
+                data={k: v for k, v in call.fields.items() if v != None}
+            )
 
-    async def listen_events(self) -> AsyncGenerator[PluginEvent | None, Any]:
-        async with self.client.listen_event() as l:
-            listener: HassEventListener = l
-            async for event in listener:
-                e: HassEvent = event
-                yield PluginEvent(
-                    id=token_urlsafe(nbytes=16),
+    async def call_actions(self, batch: list[ActionCall | dict]) -> list[ActionResult]:
+        calls: list[Optional[ActionCall]] = []
+        results: list[ActionResult] = [None] * len(batch)
+        for index, i in enumerate(batch):
+            try:
+                calls.append(ActionCall(**i) if isinstance(i, dict) else i)
+            except ValidationError as e:
+                # A malformed entry only fails itself, not the whole batch.
+                calls.append(None)
+                results[index] = ActionResult(
+                    action_id=str(i.get("action_id", "")),
+                    target=i.get("target") if type(i.get("target")) == str else None,
+                    success=False,
+                    error=str(e)
+                )
+
+        routed: dict[HassHub, list[tuple[int, ActionCall]]] = {}
+        for index, call in enumerate(calls):
+            if call == None:
+                continue
+            hub, local = self._route_call(call)
+            if hub == None:
+                results[index] = ActionResult(
+                    action_id=call.action_id,
+                    target=call.target,
+                    success=False,
+                    error="No server for " + call.action_id
+                )
+            else:
+                routed.setdefault(hub, []).append((index, local))
+
+        # Concurrency is limited per server, so a slow one cannot hold every
+        # slot while calls to the others wait.
+        semaphores = {hub: asyncio.Semaphore(max(1, self.settings.action_concurrency)) for hub in routed.keys()}
+
+        async def dispatch(hub: HassHub, group, indices: list[int]):
+            domain, _, service = group.action_id.partition(".")
+            async with semaphores[hub]:
+                try:
+                    with metrics.timer("ws.call_service"):
+                        result = await hub.connection().call_service(
+                            domain,
+                            service,
+                            target={"entity_id": group.targets} if len(
+                                group.targets) > 0 else {},
+                            data=group.fields
+                        )
+                    error = None if result.success else str(result.data)
+                except Exception as e:
+                    error = str(e)
+
+            for i in group.indices:
+                index = indices[i]
+                results[index] = ActionResult(
+                    action_id=calls[index].action_id,
+                    target=calls[index].target,
+                    success=error == None,
+                    error=error
+                )
+
+        with metrics.timer("plugin.call_actions"):
+            await asyncio.gather(*[
+                dispatch(hub, group, [i for i, _ in entries])
+                for hub, entries in routed.items()
+                for group in group_calls([i for _, i in entries])
+            ])
+        return results
+
+    async def listen_events(self, since: str = None) -> AsyncGenerator[PluginEvent | None, Any]:
+        # Passing the last seen event id as since replays what was missed
+        # from the buffer, or a compact resync of the current states if it
+        # was already evicted or handed out by an earlier run.
+        self._start_producer()
+        cursor = self.log.sequence
+        position = self.log.position(since) if since != None else cursor
+        replay = position != None and self.log.covers(position)
+        reader = self.log.subscribe(position if replay else cursor)
+        try:
+            if not replay:
+                for event in await self._resync_events(cursor):
+                    yield event
+
+            while True:
+                events = self.log.read(reader)
+                if events == None:
+                    # Fell behind further than the buffer reaches.
+                    metrics.increment("events.resyncs")
+                    cursor = self.log.sequence
+                    self.log.seek(reader, cursor)
+                    for event in await self._resync_events(cursor):
+                        yield event
+                    continue
+
+                if metrics.enabled:
+                    metrics.gauge("events.replay_depth", len(self.log.events))
+                    metrics.gauge("events.backlog", self.log.backlog())
+                for sequence, event, fired in events:
+                    if metrics.enabled:
+                        metrics.increment("events.out")
+                        if fired != None:
+                            metrics.observe("events.lag", time.time() - fired)
+                    yield event
+                    self.log.ack(reader, sequence)
+
+                if len(events) == 0:
+                    if self.log.closed:
+                        if self.log.error:
+                            raise self.log.error
+                        return
+                    await self.log.wait()
+        finally:
+            self.log.unsubscribe(reader)
+
+    def _start_producer(self):
+        if self._producer == None or self._producer.done():
+            self.log.open()
+            self._producer = asyncio.create_task(self._produce())
+
+    async def _produce(self):
+        try:
+            async for event, fired in self._events():
+                self.log.append(event, fired)
+            self.log.close()
+        except asyncio.CancelledError:
+            self.log.close()
+            raise
+        except Exception as e:
+            self.log.close(e)
+
+    async def _resync_events(self, sequence: int) -> list[PluginEvent]:
+        events = [PluginEvent(
+            id=self.log.id(sequence),
+            plugin="hass",
+            types=["resync"],
+            data={"sequence": sequence},
+            targets=[],
+            new_state=None
+        )]
+        for hub in self.hubs.values():
+            try:
+                await hub.ensure_states()
+            except Exception:
+                logger.warning("HASS server %s failed", hub.server, exc_info=True)
+                continue
+
+            events.extend([
+                PluginEvent(
+                    id=self.log.id(sequence),
                     plugin="hass",
-                    types=[e["event_type"]],
-                    data=e["data"],
-                    targets=[e["data"]["entity_id"]] if "entity_id" in e["data"].keys() else [
-                    ],
-                    new_state=EntityTransformer.transform(HassEntity(
-                        e["data"]["new_state"])) if "new_state" in e["data"].keys() else None
+                    types=["resync", "state"],
+                    data={"entity_id": entity.id},
+                    targets=[entity.id],
+                    new_state=entity
                 )
+                for entity in hub.mirror.get([i for i in hub.mirror.states.keys() if self.filter.accepts_entity(i)])
+            ])
+        return events
+
+    async def _events(self) -> AsyncGenerator[tuple[PluginEvent, Optional[float]], Any]:
+        if len(self.hubs) == 1:
+            async for event in self._hub_events(next(iter(self.hubs.values()))):
+                yield event
+            return
+
+        async for event in fair_merge(*[self._hub_events(i) for i in self.hubs.values()]):
+            yield event
+
+    async def _hub_events(self, hub: HassHub) -> AsyncGenerator[tuple[PluginEvent, Optional[float]], Any]:
+        try:
+            async for event in self._coalesced_events(hub):
+                yield event
+        except Exception:
+            logger.warning("HASS server %s event stream failed", hub.server, exc_info=True)
+            raise
+
+    async def _coalesced_events(self, hub: HassHub) -> AsyncGenerator[tuple[PluginEvent, Optional[float]], Any]:
+        # Events come paired with when HA fired them, lag is measured once
+        # they are actually delivered to a listener.
+        coalescer = EventCoalescer(
+            window=self.settings.coalesce_window,
+            domain_windows=self.settings.coalesce_domains,
+            bypass_states=self.settings.coalesce_bypass,
+            queue_size=self.settings.event_queue_size,
+            overflow=self.settings.event_overflow,
+        )
+        if not coalescer.enabled:
+            async for e in hub.events(self.filter):
+                event = self._plugin_event(hub, e)
+                if event:
+                    yield event, self._fired(e)
+            return
+
+        # Events are read and coalesced in the background. Transforms only
+        # happen here, for events that survived their coalescing window.
+        reader = asyncio.create_task(self._read_into(hub, coalescer))
+        try:
+            while True:
+                e = await coalescer.get()
+                if e == None:
+                    break
+                metrics.gauge("events.queue_depth", coalescer.queue.qsize())
+                metrics.gauge("events.pending", len(coalescer.pending))
+                metrics.gauge("events.dropped", coalescer.dropped)
+                event = self._plugin_event(hub, e)
+                if event:
+                    yield event, self._fired(e)
+            await reader
+        finally:
+            reader.cancel()
+            await asyncio.gather(reader, return_exceptions=True)
+
+    async def _read_into(self, hub: HassHub, coalescer: EventCoalescer):
+        try:
+            async for e in hub.events(self.filter):
+                await coalescer.put(e)
+        finally:
+            if asyncio.current_task().cancelling():
+                await coalescer.cancel()
+            else:
+                await coalescer.close()
+
+    def _plugin_event(self, hub: HassHub, e: HassEvent) -> Optional[PluginEvent]:
+        if self.settings.delta_events and e["event_type"] == "state_changed" and e["data"].get("old_state") and e["data"].get("new_state"):
+            event = self._delta_event(hub, e)
+        else:
+            event = self._full_event(hub, e)
+        return event
+
+    @staticmethod
+    def _fired(e: HassEvent) -> Optional[float]:
+        if not metrics.enabled or not e.get("time_fired"):
+            return None
+        try:
+            return datetime.datetime.fromisoformat(e["time_fired"]).timestamp()
+        except (TypeError, ValueError):
+            return None
+
+    def _full_event(self, hub: HassHub, e: HassEvent) -> PluginEvent:
+        new_state = None
+        if e["data"].get("new_state"):
+            state = HassEntity(e["data"]["new_state"])
+            new_state = EntityTransformer.transform(
+                state, namespace=hub.namespace)
+            if e["event_type"] == "state_changed":
+                hub.mirror.cache(state, new_state)
+
+        return PluginEvent(
+            id="",
+            plugin="hass",
+            types=[e["event_type"]],
+            data=e["data"],
+            targets=[hub.namespace + e["data"]["entity_id"]] if "entity_id" in e["data"].keys() else [
+            ],
+            new_state=new_state
+        )
+
+    def _delta_event(self, hub: HassHub, e: HassEvent) -> Optional[PluginEvent]:
+        old = HassEntity(e["data"]["old_state"])
+        state = HassEntity(e["data"]["new_state"])
+        entity, removed = EntityTransformer.delta_transform(
+            old, state, namespace=hub.namespace)
+        # friendly_name is a denied key, so a rename changes no property.
+        before = EntityTransformer.entity_display(old)
+        relabeled = (before.label, before.icon) != (entity.display.label, entity.display.icon)
+        if len(entity.properties) == 0 and len(removed) == 0 and not relabeled:
+            return None
+
+        return PluginEvent(
+            id="",
+            plugin="hass",
+            types=[e["event_type"], "delta"],
+            data={
+                "entity_id": entity.id,
+                "changed": list(entity.properties.keys()),
+                "removed": removed,
+                "display": relabeled,
+            },
+            targets=[entity.id],
+            new_state=entity
+        )
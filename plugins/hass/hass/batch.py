@@ -0,0 +1,49 @@
+import json
+from typing import Any, Optional
+from pydantic import BaseModel
+
+
+class ActionCall(BaseModel):
+    action_id: str
+    target: Optional[str] = None
+    fields: dict[str, Any] = {}
+
+
+class ActionResult(BaseModel):
+    action_id: str
+    target: Optional[str] = None
+    success: bool
+    error: Optional[str] = None
+
+
+class CallGroup:
+    def __init__(self, action_id: str, fields: dict[str, Any]):
+        self.action_id = action_id
+        self.fields = fields
+        self.targets: list[str] = []
+        self.indices: list[int] = []
+
+
+def group_calls(calls: list[ActionCall]) -> list[CallGroup]:
+    # Calls to the same service with identical fields become one call_service
+    # with a list of entity_id targets. Untargeted calls are never merged, and
+    # a repeated target starts a new group so non-idempotent calls such as
+    # toggle still run once per call.
+    groups: dict[tuple[str, str], CallGroup] = {}
+    output = []
+    for index, call in enumerate(calls):
+        fields = {k: v for k, v in call.fields.items() if v != None}
+        if not call.target:
+            group = CallGroup(call.action_id, fields)
+            output.append(group)
+        else:
+            key = (call.action_id, json.dumps(
+                fields, sort_keys=True, default=str))
+            if not key in groups or call.target in groups[key].targets:
+                groups[key] = CallGroup(call.action_id, fields)
+                output.append(groups[key])
+            group = groups[key]
+            group.targets.append(call.target)
+
+        group.indices.append(index)
+    return output
@@ -0,0 +1,90 @@
+import time
+from typing import Optional
+from haus_utils import EntityAction
+from hass_websocket_client.models import HassService
+
+from .transformers import ActionTransformer
+
+
+class ActionCatalog:
+    def __init__(self, resync_interval: float = 0, namespace: str = ""):
+        self.resync_interval = resync_interval
+        self.namespace = namespace
+        self.services: dict[str, HassService] = {}
+        self.actions: dict[str, EntityAction] = {}
+        self.domains: dict[str, set[str]] = {}
+        self.invalidated = False
+        self.synced_at: Optional[float] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self.synced_at != None
+
+    @property
+    def stale(self) -> bool:
+        if not self.loaded or self.invalidated:
+            return True
+        if self.resync_interval <= 0:
+            return False
+        return time.monotonic() - self.synced_at >= self.resync_interval
+
+    def changed(self, services: dict[str, dict[str, HassService]]) -> list[tuple[str, str, HassService]]:
+        return [
+            (domain, service, data)
+            for domain, entries in services.items()
+            for service, data in entries.items()
+            if not (domain + "." + service in self.actions and self.services.get(domain + "." + service) == data)
+        ]
+
+    def load(self, services: dict[str, dict[str, HassService]], transformed: dict[str, EntityAction] = {}):
+        # Only services that are new, were invalidated or whose definition
+        # changed since the last load are transformed again, unless they
+        # were already transformed elsewhere.
+        previous = self.services
+        self.services = {}
+        self.domains = {}
+        actions = {}
+        for domain, entries in services.items():
+            for service, data in entries.items():
+                action_id = domain + "." + service
+                self.services[action_id] = data
+                self.domains.setdefault(domain, set()).add(action_id)
+                if action_id in self.actions and previous.get(action_id) == data:
+                    actions[action_id] = self.actions[action_id]
+                elif action_id in transformed:
+                    actions[action_id] = transformed[action_id]
+                else:
+                    actions[action_id] = ActionTransformer.transform(
+                        domain, service, data, namespace=self.namespace)
+
+        self.actions = actions
+        self.invalidated = False
+        self.synced_at = time.monotonic()
+
+    def restore(self, services: dict[str, HassService], actions: dict[str, EntityAction]):
+        self.services = services
+        self.actions = actions
+        self.domains = {}
+        for action_id in actions.keys():
+            self.domains.setdefault(action_id.partition(".")[0], set()).add(action_id)
+        self.invalidated = False
+        self.synced_at = time.monotonic()
+
+    def invalidate(self, domain: str, service: str = None):
+        for action_id in [domain + "." + service] if service else list(self.domains.get(domain, [])):
+            self.services.pop(action_id, None)
+        self.invalidated = True
+
+    def remove(self, domain: str, service: str):
+        action_id = domain + "." + service
+        self.services.pop(action_id, None)
+        self.actions.pop(action_id, None)
+        if domain in self.domains:
+            self.domains[domain].discard(action_id)
+            if len(self.domains[domain]) == 0:
+                del self.domains[domain]
+
+    def get(self, ids: list[str] = None) -> list[EntityAction]:
+        if ids == None:
+            return list(self.actions.values())
+        return [self.actions[i] for i in dict.fromkeys(ids) if i in self.actions]
@@ -0,0 +1,93 @@
+import datetime
+import json
+import re
+from typing import Any
+
+FALSE_TOKENS = frozenset(["off", "false", "no"])
+TRUE_TOKENS = frozenset(["on", "true", "yes"])
+
+# ASCII subset of what float() accepts. Strings outside it (non-ASCII text,
+# digit group underscores) are rare and go through float() itself.
+NUMBER_PATTERN = re.compile(
+    r"[ \t\n\v\f\r]*[+-]?(?:(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][+-]?[0-9]+)?|inf|infinity|nan)[ \t\n\v\f\r]*",
+    re.IGNORECASE,
+)
+
+# Every form datetime.fromisoformat() accepts starts with a four digit year
+# followed by a date separator, a month/day digit or a week marker.
+ISO_PREFIX_PATTERN = re.compile(r"[0-9]{4}[-0-9W]")
+
+
+def _parse_number(value: str) -> float | None:
+    if value.isascii() and not "_" in value:
+        return float(value) if NUMBER_PATTERN.fullmatch(value) else None
+
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def _parse_datetime(value: str) -> datetime.datetime | None:
+    if value.isascii() and not ISO_PREFIX_PATTERN.match(value):
+        return None
+
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+def classify_value(value: Any) -> tuple[Any, str]:
+    vtype = type(value)
+    if vtype == str:
+        pass
+    elif vtype == int or vtype == float:
+        return value, "number"
+    elif vtype == dict:
+        return json.dumps(value), "string"
+    elif vtype == list:
+        return value, "list"
+    else:
+        value = str(value)
+
+    lowered = value.lower()
+    if lowered in FALSE_TOKENS:
+        return False, "boolean"
+    if lowered in TRUE_TOKENS:
+        return True, "boolean"
+
+    number = _parse_number(value)
+    if number != None:
+        return number, "number"
+
+    date = _parse_datetime(value)
+    if date != None:
+        return date, "datetime"
+
+    return value, "string"
+
+
+def classify_hinted(value: Any, hint: str = None) -> tuple[Any, str]:
+    # Tries the type the value had last time with only the check for that
+    # type. The token sets and the number grammar never overlap, so a hit is
+    # what classify_value would return, a miss falls back to it.
+    vtype = type(value)
+    if hint == "number":
+        if vtype == int or vtype == float:
+            return value, "number"
+        if vtype == str:
+            number = _parse_number(value)
+            if number != None:
+                return number, "number"
+    elif hint == "boolean" and (vtype == str or vtype == bool):
+        lowered = str(value).lower()
+        if lowered in FALSE_TOKENS:
+            return False, "boolean"
+        if lowered in TRUE_TOKENS:
+            return True, "boolean"
+    return classify_value(value)
+
+
+def classify_values(values: dict[str, Any]) -> dict[str, tuple[Any, str]]:
+    return {k: classify_value(v) for k, v in values.items()}
@@ -0,0 +1,122 @@
+import asyncio
+import heapq
+import time
+from typing import Literal, Optional
+from hass_websocket_client.client import HassEvent
+
+OverflowPolicy = Literal["block", "drop_oldest", "drop_newest"]
+
+
+class EventCoalescer:
+    def __init__(
+        self,
+        window: float = 0,
+        domain_windows: dict[str, float] = {},
+        bypass_states: list[str] = [],
+        queue_size: int = 1000,
+        overflow: OverflowPolicy = "block",
+    ):
+        self.window = window
+        self.domain_windows = domain_windows
+        self.bypass_states = set(bypass_states)
+        self.overflow = overflow
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, queue_size))
+        self.pending: dict[str, tuple[float, HassEvent]] = {}
+        self.deadlines: list[tuple[float, str]] = []
+        self.dropped = 0
+        self._wakeup = asyncio.Event()
+        self._flusher: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0 or any([i > 0 for i in self.domain_windows.values()])
+
+    def window_for(self, entity_id: str) -> float:
+        return self.domain_windows.get(entity_id.partition(".")[0], self.window)
+
+    def bypasses(self, event: HassEvent) -> bool:
+        for key in ["old_state", "new_state"]:
+            state = event["data"].get(key)
+            if not state or state.get("state") in self.bypass_states:
+                return True
+        return False
+
+    async def put(self, event: HassEvent):
+        if self._flusher == None:
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+        entity_id = event["data"].get("entity_id")
+        if event["event_type"] != "state_changed" or type(entity_id) != str:
+            await self._enqueue(event)
+            return
+
+        window = self.window_for(entity_id)
+        if entity_id in self.pending:
+            # Keep the state from the start of the window as old_state so the
+            # emitted event still describes the full transition.
+            first = self.pending[entity_id][1]
+            event = {**event, "data": {**event["data"],
+                                       "old_state": first["data"].get("old_state")}}
+
+        if window <= 0 or self.bypasses(event):
+            self.pending.pop(entity_id, None)
+            await self._enqueue(event)
+            return
+
+        if entity_id in self.pending:
+            deadline = self.pending[entity_id][0]
+        else:
+            deadline = time.monotonic() + window
+            heapq.heappush(self.deadlines, (deadline, entity_id))
+            self._wakeup.set()
+        self.pending[entity_id] = (deadline, event)
+
+    async def get(self) -> Optional[HassEvent]:
+        return await self.queue.get()
+
+    async def cancel(self):
+        if self._flusher:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+
+    async def close(self):
+        # Flushes everything still pending and marks the end of the stream.
+        await self.cancel()
+        self.deadlines = []
+        pending, self.pending = self.pending, {}
+        for _, event in pending.values():
+            await self._enqueue(event)
+        await self._enqueue(None, force=True)
+
+    async def _enqueue(self, event: Optional[HassEvent], force: bool = False):
+        if force or self.overflow == "block":
+            await self.queue.put(event)
+            return
+
+        if self.queue.full():
+            self.dropped += 1
+            if self.overflow == "drop_newest":
+                return
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+    async def _flush_loop(self):
+        while True:
+            if len(self.deadlines) == 0:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            delay = self.deadlines[0][0] - time.monotonic()
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            deadline, entity_id = heapq.heappop(self.deadlines)
+            if entity_id in self.pending and self.pending[entity_id][0] == deadline:
+                await self._enqueue(self.pending.pop(entity_id)[1])
@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import random
+from typing import Any
+from hass_websocket_client import HassWS
+
+logger = logging.getLogger(__name__)
+
+
+def backoff_delay(attempt: int, base: float = 1, cap: float = 60) -> float:
+    # Full jitter, so hubs and plugins that lost the same server do not
+    # all reconnect at the same moment.
+    return random.uniform(0, min(cap, base * (2 ** min(attempt, 32))))
+
+
+class HassConnectionManager:
+    # One dedicated connection carries event subscriptions, so bursts of
+    # events never queue in front of commands on the command pool.
+    def __init__(self, server: str, token: str, pool_size: int = 2):
+        self.server = server
+        self.token = token
+        self.pool_size = max(1, pool_size)
+        self.events: HassWS = None
+        self.commands: list[HassWS] = []
+        self.in_flight: list[int] = []
+        self._locks: list[asyncio.Lock] = []
+        self._events_lock = asyncio.Lock()
+
+    async def _open(self) -> HassWS:
+        return await HassWS(self.server, self.token)
+
+    @staticmethod
+    async def _close(client: HassWS):
+        try:
+            await client.close()
+        except Exception:
+            pass
+
+    async def connect(self):
+        tasks = [asyncio.ensure_future(self._open()) for _ in range(self.pool_size + 1)]
+        try:
+            clients = await asyncio.gather(*tasks)
+        except BaseException:
+            # Don't leak the connections that did open, also when a timeout
+            # cancels us halfway through.
+            for i in tasks:
+                i.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await asyncio.gather(*[
+                self._close(i.result()) for i in tasks if not i.cancelled() and i.exception() == None])
+            raise
+        self.events, *self.commands = clients
+        self.in_flight = [0] * self.pool_size
+        self._locks = [asyncio.Lock() for _ in range(self.pool_size)]
+
+    async def close(self):
+        clients = [i for i in [self.events, *self.commands] if i]
+        self.events = None
+        self.commands = []
+        await asyncio.gather(*[self._close(i) for i in clients])
+
+    async def reconnect_events(self) -> HassWS:
+        async with self._events_lock:
+            if self.events:
+                await self._close(self.events)
+            self.events = None
+            self.events = await self._open()
+            return self.events
+
+    async def _reconnect(self, index: int, broken: HassWS):
+        async with self._locks[index]:
+            # Another request on the same slot may have reconnected already.
+            if self.commands[index] is broken:
+                await self._close(broken)
+                self.commands[index] = await self._open()
+
+    async def request(self, method: str, *args, retry: bool = True, **kwargs) -> Any:
+        if len(self.commands) == 0:
+            raise ConnectionError("Not connected to " + self.server)
+        index = self.in_flight.index(min(self.in_flight))
+        self.in_flight[index] += 1
+        try:
+            client = self.commands[index]
+            try:
+                return await getattr(client, method)(*args, **kwargs)
+            except Exception:
+                logger.warning(
+                    "HASS command connection %s failed during %s, reconnecting", index, method)
+                await self._reconnect(index, client)
+                if not retry:
+                    raise
+                return await getattr(self.commands[index], method)(*args, **kwargs)
+        finally:
+            self.in_flight[index] -= 1
+
+    async def fetch_states(self):
+        return await self.request("fetch_states")
+
+    async def fetch_services(self):
+        return await self.request("fetch_services")
+
+    async def call_service(self, *args, **kwargs):
+        # Not retried, a call that failed mid-flight may already have run.
+        return await self.request("call_service", *args, retry=False, **kwargs)
+
+    def listen_event(self, *args, **kwargs):
+        return self.events.listen_event(*args, **kwargs)
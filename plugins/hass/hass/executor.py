@@ -0,0 +1,95 @@
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Literal, Optional
+from haus_utils import PluginEntity, EntityAction
+from hass_websocket_client.models import HassEntity, HassService
+
+from .transformers import EntityTransformer, ActionTransformer
+from .models import ModelBuilder
+from .metrics import Histogram, metrics
+
+TransformMode = Literal["inline", "yield", "thread", "process"]
+
+
+def transform_entities(states: list[HassEntity], namespace: str = "") -> list[PluginEntity]:
+    return [EntityTransformer.transform(i, namespace=namespace) for i in states]
+
+
+def transform_actions(services: list[tuple[str, str, HassService]], namespace: str = "") -> list[EntityAction]:
+    return [ActionTransformer.transform(domain, service, data, namespace=namespace) for domain, service, data in services]
+
+
+def _init_worker(trusted: bool, plan_cache_size: int, metrics_enabled: bool):
+    ModelBuilder.trusted = trusted
+    EntityTransformer.PLAN_CACHE_SIZE = plan_cache_size
+    metrics.enabled = metrics_enabled
+
+
+def _measured(func: Callable[..., list[Any]], items: list[Any], *args: Any) -> tuple[list[Any], dict[str, Histogram]]:
+    # Runs in a worker process, whose metrics are handed back to be merged.
+    metrics.reset()
+    return func(items, *args), metrics.histograms
+
+
+class TransformExecutor:
+    # Runs bulk transforms without holding the event loop for the whole
+    # batch: "yield" transforms chunk by chunk and lets the loop run in
+    # between, "thread"/"process" hand chunks to a pool. Batches of at most
+    # one chunk are always transformed inline.
+    def __init__(self, mode: TransformMode = "inline", chunk_size: int = 100, workers: int = 0):
+        self.mode = mode
+        self.chunk_size = max(1, chunk_size)
+        self.workers = workers
+        self._pool: Optional[Executor] = None
+
+    @property
+    def offloads(self) -> bool:
+        return self.mode != "inline"
+
+    def _executor(self) -> Executor:
+        if self._pool == None:
+            if self.mode == "process":
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers or None, initializer=_init_worker, initargs=(ModelBuilder.trusted, EntityTransformer.PLAN_CACHE_SIZE, metrics.enabled))
+            else:
+                # Transforms hold the GIL, more threads only take it away
+                # from the loop more often without finishing sooner.
+                self._pool = ThreadPoolExecutor(
+                    max_workers=self.workers or 1, thread_name_prefix="hass-transform")
+        return self._pool
+
+    async def map(self, func: Callable[..., list[Any]], items: list[Any], *args: Any) -> list[Any]:
+        if not self.offloads or len(items) <= self.chunk_size:
+            return func(items, *args)
+
+        chunks = [items[i:i + self.chunk_size]
+                  for i in range(0, len(items), self.chunk_size)]
+        if self.mode == "yield":
+            results = []
+            for chunk in chunks:
+                results.extend(func(chunk, *args))
+                await asyncio.sleep(0)
+            return results
+
+        loop = asyncio.get_running_loop()
+        executor = self._executor()
+        if self.mode == "process":
+            measured = await asyncio.gather(*[loop.run_in_executor(executor, _measured, func, i, *args) for i in chunks])
+            results = []
+            for chunk, histograms in measured:
+                metrics.merge(histograms)
+                results.append(chunk)
+        else:
+            results = await asyncio.gather(*[loop.run_in_executor(executor, func, i, *args) for i in chunks])
+        return [i for chunk in results for i in chunk]
+
+    async def entities(self, states: list[HassEntity], namespace: str = "") -> list[PluginEntity]:
+        return await self.map(transform_entities, states, namespace)
+
+    async def actions(self, services: list[tuple[str, str, HassService]], namespace: str = "") -> list[EntityAction]:
+        return await self.map(transform_actions, services, namespace)
+
+    def close(self):
+        if self._pool:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
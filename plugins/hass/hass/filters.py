@@ -0,0 +1,41 @@
+import re
+from fnmatch import translate
+from typing import Optional
+from hass_websocket_client.client import HassEvent
+
+
+def compile_globs(patterns: list[str]) -> Optional[re.Pattern]:
+    if len(patterns) == 0:
+        return None
+    return re.compile("|".join([translate(i) for i in patterns]))
+
+
+class EventFilter:
+    def __init__(self, event_types: list[str], entities: list[str], domains: list[str]):
+        self.event_types = set(event_types)
+        self.entities = compile_globs(entities)
+        self.domains = compile_globs(domains)
+
+    def subscriptions(self, required: list[str]) -> Optional[list[str]]:
+        # None means a single subscription to every event type.
+        if len(self.event_types) == 0:
+            return None
+        return sorted(self.event_types.union(required))
+
+    def accepts(self, event: HassEvent) -> bool:
+        if len(self.event_types) > 0 and not event["event_type"] in self.event_types:
+            return False
+
+        entity_id = event["data"].get("entity_id")
+        if type(entity_id) != str:
+            return True
+        return self.accepts_entity(entity_id)
+
+    def accepts_entity(self, entity_id: str) -> bool:
+        if self.entities == None and self.domains == None:
+            return True
+        if self.entities != None and self.entities.match(entity_id):
+            return True
+        if self.domains != None and self.domains.match(entity_id.partition(".")[0]):
+            return True
+        return False
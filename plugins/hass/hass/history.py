@@ -0,0 +1,135 @@
+import datetime
+import time
+from array import array
+from typing import Any, Optional
+from hass_websocket_client.models import HassEntity
+
+from .classify import classify_value
+from .transformers import EntityTransformer
+
+
+class PropertyHistory:
+    # Fixed-size ring of samples kept in two float arrays, 16 bytes per
+    # sample regardless of how many are retained.
+    __slots__ = ("times", "values", "start", "count")
+
+    def __init__(self, size: int):
+        self.times = array("d", [0.0]) * size
+        self.values = array("d", [0.0]) * size
+        self.start = 0
+        self.count = 0
+
+    def _index(self, position: int) -> int:
+        return (self.start + position) % len(self.times)
+
+    @property
+    def last(self) -> Optional[float]:
+        return self.values[self._index(self.count - 1)] if self.count > 0 else None
+
+    def append(self, timestamp: float, value: float):
+        if self.count > 0:
+            # Keep timestamps ordered for the binary search in since().
+            timestamp = max(timestamp, self.times[self._index(self.count - 1)])
+        if self.count < len(self.times):
+            index = self._index(self.count)
+            self.count += 1
+        else:
+            index = self.start
+            self.start = (self.start + 1) % len(self.times)
+        self.times[index] = timestamp
+        self.values[index] = value
+
+    def prune(self, before: float):
+        # The newest sample always stays, it holds the current value.
+        while self.count > 1 and self.times[self.start] < before:
+            self.start = (self.start + 1) % len(self.times)
+            self.count -= 1
+
+    def since(self, timestamp: float = None) -> list[tuple[float, float]]:
+        # Starts at the last sample at or before timestamp, which is the
+        # value the property had at that time.
+        first = 0
+        if timestamp != None:
+            low, high = 0, self.count
+            while low < high:
+                middle = (low + high) // 2
+                if self.times[self._index(middle)] <= timestamp:
+                    low = middle + 1
+                else:
+                    high = middle
+            first = max(0, low - 1)
+        return [(self.times[i], self.values[i]) for i in map(self._index, range(first, self.count))]
+
+
+class HistoryCache:
+    def __init__(self, size: int = 256, duration: float = 0, domains: list[str] = []):
+        self.size = max(1, size)
+        self.duration = duration
+        self.domains = set(domains)
+        self.properties: dict[str, PropertyHistory] = {}
+
+    @staticmethod
+    def number(value: Any) -> Optional[float]:
+        if type(value) == int or type(value) == float:
+            return float(value)
+        if type(value) == str:
+            parsed_value, value_type = classify_value(value)
+            if value_type == "number":
+                return float(parsed_value)
+        return None
+
+    @staticmethod
+    def timestamp(state: HassEntity) -> float:
+        try:
+            return datetime.datetime.fromisoformat(state["last_updated"]).timestamp()
+        except (KeyError, TypeError, ValueError):
+            return time.time()
+
+    def tracks(self, entity_id: str) -> bool:
+        return len(self.domains) == 0 or entity_id.partition(".")[0] in self.domains
+
+    def _cutoff(self) -> Optional[float]:
+        return time.time() - self.duration if self.duration > 0 else None
+
+    def record(self, state: HassEntity):
+        # Samples are only added when a value changed, so a steady sensor
+        # costs one sample however often its attributes update.
+        entity_id = state["entity_id"]
+        if not self.tracks(entity_id):
+            return
+
+        timestamp = self.timestamp(state)
+        cutoff = self._cutoff()
+        for key, value in [("state", state.get("state")), *state.get("attributes", {}).items()]:
+            if key.lower() in EntityTransformer.DENIED_KEYS:
+                continue
+            number = self.number(value)
+            if number == None:
+                continue
+
+            pid = entity_id + "." + key
+            history = self.properties.get(pid)
+            if history == None:
+                history = PropertyHistory(self.size)
+                self.properties[pid] = history
+            elif history.last == number:
+                continue
+            history.append(timestamp, number)
+            if cutoff != None:
+                history.prune(cutoff)
+
+    def remove(self, entity_id: str):
+        prefix = entity_id + "."
+        for pid in [i for i in self.properties.keys() if i.startswith(prefix)]:
+            del self.properties[pid]
+
+    def get(self, ids: list[str] = None, since: float = None) -> dict[str, list[tuple[float, float]]]:
+        cutoff = self._cutoff()
+        keys = list(self.properties.keys()) if ids == None else [
+            i for i in dict.fromkeys(ids) if i in self.properties]
+        history = {}
+        for pid in keys:
+            if cutoff != None:
+                self.properties[pid].prune(cutoff)
+            history[pid] = self.properties[pid].since(since)
+        return history
@@ -0,0 +1,341 @@
+import asyncio
+import logging
+from collections.abc import AsyncGenerator, Awaitable, Callable
+from contextlib import AsyncExitStack
+from typing import Any, Optional
+from haus_utils import PluginEntity, EntityAction
+from hass_websocket_client.client import HassEventListener, HassEvent, HassEntity
+
+from .mirror import StateMirror
+from .catalog import ActionCatalog
+from .filters import EventFilter
+from .streams import merge_streams
+from .metrics import metrics
+from .snapshot import Snapshot
+from .connection import HassConnectionManager, backoff_delay
+from .history import HistoryCache
+from .executor import TransformExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class HassHub:
+    # Event types the plugin itself depends on to keep its caches current.
+    TRACKED_EVENTS = ["state_changed",
+                      "service_registered", "service_removed"]
+
+    # Connections, mirror, catalog and snapshot of a single server. Ids it
+    # hands out are prefixed with its namespace, which stays empty unless
+    # the plugin was configured with named servers.
+    def __init__(
+        self,
+        name: str,
+        server: str,
+        token: str,
+        namespace: str = "",
+        resync_interval: float = 0,
+        pool_size: int = 2,
+        snapshot_path: str = "",
+        timeout: float = 0,
+        history: HistoryCache = None,
+        reconnect: bool = False,
+        reconnect_delay: float = 1,
+        reconnect_max_delay: float = 60,
+        executor: TransformExecutor = None,
+    ):
+        self.name = name
+        self.server = server
+        self.token = token
+        self.namespace = namespace
+        self.pool_size = pool_size
+        self.snapshot_path = snapshot_path
+        self.timeout = timeout
+        self.history = history
+        self.reconnect = reconnect
+        self.reconnect_delay = reconnect_delay
+        self.reconnect_max_delay = reconnect_max_delay
+        self.executor = executor or TransformExecutor()
+        self.client: HassConnectionManager = None
+        self.mirror = StateMirror(
+            resync_interval=resync_interval, namespace=namespace)
+        self.catalog = ActionCatalog(
+            resync_interval=resync_interval, namespace=namespace)
+        self._resync_lock = asyncio.Lock()
+        self._catalog_lock = asyncio.Lock()
+        self._reconcile_task: Optional[asyncio.Task] = None
+        self._refreshing: dict[str, asyncio.Task] = {}
+        self._injected: asyncio.Queue = asyncio.Queue()
+        self._listeners = 0
+
+    async def initialize(self):
+        restored = self.restore_snapshot()
+        self.client = HassConnectionManager(
+            self.server, self.token, pool_size=self.pool_size)
+        await self.client.connect()
+        if restored:
+            # Serve the snapshot right away and catch up in the background.
+            self._reconcile_task = asyncio.create_task(self._reconcile())
+        else:
+            await self.resync()
+
+    async def close(self):
+        for task in [self._reconcile_task, *self._refreshing.values()]:
+            if task:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        self._reconcile_task = None
+        self._refreshing = {}
+
+        await self.save_snapshot()
+
+        if self.client:
+            await self.client.close()
+            self.client = None
+
+    def connection(self) -> HassConnectionManager:
+        if self.client == None:
+            raise ConnectionError("Not connected to " + self.server)
+        return self.client
+
+    async def resync(self, emit: bool = False) -> bool:
+        async with self._resync_lock:
+            self.mirror.begin_sync()
+            try:
+                with metrics.timer("ws.get_states"):
+                    result = await self.client.fetch_states()
+                if not result.success:
+                    return False
+
+                # Running listeners get synthetic events for whatever drifted,
+                # so they stay consistent with the mirror without a full reload.
+                if self.mirror.loaded and (emit or self._listeners > 0):
+                    for event in self.mirror.diff(result.data):
+                        self._injected.put_nowait(event)
+                self.mirror.load(result.data)
+            finally:
+                self.mirror.end_sync()
+
+        await self.save_snapshot()
+        return True
+
+    async def refresh_actions(self) -> bool:
+        async with self._catalog_lock:
+            with metrics.timer("ws.get_services"):
+                result = await self.client.fetch_services()
+            if not result.success:
+                return False
+
+            transformed = {}
+            if self.executor.offloads:
+                changed = self.catalog.changed(result.data)
+                actions = await self.executor.actions(changed, self.namespace)
+                transformed = {
+                    domain + "." + service: action for (domain, service, _), action in zip(changed, actions)}
+            self.catalog.load(result.data, transformed)
+            return True
+
+    def restore_snapshot(self) -> bool:
+        if not self.snapshot_path:
+            return False
+
+        snapshot = Snapshot.load(
+            self.snapshot_path, self.server, self.namespace)
+        if snapshot == None:
+            return False
+
+        self.mirror.load(snapshot.states)
+        self.catalog.restore(snapshot.services, snapshot.actions)
+        return True
+
+    async def save_snapshot(self):
+        if not self.snapshot_path or not self.mirror.loaded:
+            return
+
+        # Only the containers are copied on the loop. States and actions are
+        # replaced rather than mutated, so pickling them off the loop is safe.
+        snapshot = Snapshot(list(self.mirror.states.values()), dict(self.catalog.services), dict(
+            self.catalog.actions))
+        try:
+            await asyncio.to_thread(snapshot.save, self.snapshot_path, self.server, self.namespace)
+        except OSError:
+            logger.exception("Failed to write snapshot to %s",
+                             self.snapshot_path)
+
+    async def _reconcile(self):
+        # Consumers were served the snapshot, so the differences are queued
+        # even if nobody is listening yet.
+        await self.resync(emit=True)
+        await self.refresh_actions()
+
+    async def _refreshed(self, store: StateMirror | ActionCatalog, refresh: Callable[[], Awaitable[bool]]):
+        # Waits at most timeout for a stale store. A slow hub keeps serving
+        # what it already has while the refresh finishes in the background,
+        # it only fails if there is nothing to serve yet.
+        if not store.stale:
+            return
+
+        key = refresh.__name__
+        task = self._refreshing.get(key)
+        if task == None or task.done():
+            task = asyncio.create_task(refresh())
+            task.add_done_callback(
+                lambda t: t.cancelled() or t.exception())
+            self._refreshing[key] = task
+
+        try:
+            await asyncio.wait_for(asyncio.shield(task), self.timeout if self.timeout > 0 else None)
+        except Exception:
+            if not store.loaded:
+                raise
+            logger.warning(
+                "HASS server %s did not refresh in time, serving cached data", self.server)
+
+    async def ensure_states(self):
+        await self._refreshed(self.mirror, self.resync)
+
+    async def ensure_actions(self):
+        await self._refreshed(self.catalog, self.refresh_actions)
+
+    async def _prepare(self, ids: Optional[list[str]]):
+        # Transforms uncached entities through the executor. Results are
+        # cached on the loop, and only if their state is still current.
+        if not self.executor.offloads:
+            return
+        states = self.mirror.uncached(ids)
+        if len(states) == 0:
+            return
+        entities = await self.executor.entities(states, self.namespace)
+        size = self.executor.chunk_size
+        for start in range(0, len(states), size):
+            for state, entity in zip(states[start:start + size], entities[start:start + size]):
+                self.mirror.cache(state, entity)
+            if len(states) > size:
+                await asyncio.sleep(0)
+
+    async def get_entities(self, ids: list[str] = None) -> list[PluginEntity]:
+        await self.ensure_states()
+        await self._prepare(ids)
+        return self.mirror.get(ids)
+
+    async def query_entities(self, **criteria: Optional[str | list[str]]) -> list[PluginEntity]:
+        await self.ensure_states()
+        ids = self.mirror.query(**criteria)
+        await self._prepare(ids)
+        return self.mirror.get(ids)
+
+    async def chunks(self, ids: Optional[list[str]], size: int) -> AsyncGenerator[list[PluginEntity], Any]:
+        if not self.executor.offloads:
+            for chunk in self.mirror.chunks(ids, size=size):
+                yield chunk
+            return
+
+        keys = self.mirror.keys(ids)
+        size = max(1, size)
+        for start in range(0, len(keys), size):
+            states = [self.mirror.states[i]
+                      for i in keys[start:start + size] if i in self.mirror.states]
+            cached = [self.mirror.entities.get(i["entity_id"]) for i in states]
+            transformed = iter(await self.executor.entities([s for s, e in zip(states, cached) if e == None], self.namespace))
+            yield [e if e != None else next(transformed) for e in cached]
+
+    async def get_actions(self, ids: list[str] = None) -> list[EntityAction]:
+        await self.ensure_actions()
+        return self.catalog.get(ids)
+
+    async def reconnect_events(self):
+        if self.client == None or len(self.client.commands) == 0:
+            # Never got connected, start over with the whole pool.
+            if self.client:
+                await self.client.close()
+            self.client = HassConnectionManager(
+                self.server, self.token, pool_size=self.pool_size)
+            await self.client.connect()
+        else:
+            await self.client.reconnect_events()
+        # Services may have changed while disconnected.
+        self.catalog.invalidated = True
+
+    async def events(self, filter: EventFilter) -> AsyncGenerator[HassEvent, Any]:
+        # Supervises the subscription. When it drops the hub reconnects with
+        # jittered backoff and resyncs, so listeners only see the entities
+        # that changed in between instead of the stream ending.
+        event_types = filter.subscriptions(self.TRACKED_EVENTS)
+        attempt = 0
+        while True:
+            try:
+                async for event in self._subscribe(event_types, resync=attempt > 0):
+                    attempt = 0
+                    e: HassEvent = event
+                    metrics.increment("events.in")
+                    if e.get("origin") != "RESYNC" and e["event_type"] == "state_changed" and e["data"].get("new_state") and self.mirror.outdated(e["data"]["new_state"]):
+                        continue
+                    self._track(e)
+                    if filter.accepts(e):
+                        yield e
+                if not self.reconnect:
+                    return
+                logger.warning("HASS server %s ended the event stream", self.server)
+            except Exception:
+                if not self.reconnect:
+                    raise
+                logger.warning("HASS server %s event stream failed",
+                               self.server, exc_info=True)
+
+            attempt += 1
+            metrics.increment("events.reconnects")
+            await asyncio.sleep(backoff_delay(attempt - 1, self.reconnect_delay, self.reconnect_max_delay))
+            try:
+                await self.reconnect_events()
+            except Exception:
+                logger.warning("Reconnecting to HASS server %s failed",
+                               self.server, exc_info=True)
+
+    async def _subscribe(self, event_types: Optional[list[str]], resync: bool = False) -> AsyncGenerator[HassEvent, Any]:
+        self._listeners += 1
+        try:
+            async with AsyncExitStack() as stack:
+                if event_types == None:
+                    listeners: list[HassEventListener] = [await stack.enter_async_context(self.client.listen_event())]
+                else:
+                    listeners: list[HassEventListener] = [
+                        await stack.enter_async_context(self.client.listen_event(event_type=i))
+                        for i in event_types
+                    ]
+
+                if resync:
+                    # Subscribed first, so nothing that changes during the
+                    # fetch is missed. Only entities that changed while
+                    # disconnected are emitted.
+                    await self.resync(emit=True)
+
+                async for event in merge_streams(*listeners, auxiliary=[self._injected_events()]):
+                    yield event
+        finally:
+            self._listeners -= 1
+
+    async def _injected_events(self) -> AsyncGenerator[HassEvent, Any]:
+        while True:
+            yield await self._injected.get()
+
+    def _track(self, e: HassEvent):
+        if self.history and e["event_type"] == "state_changed":
+            if e["data"].get("new_state"):
+                self.history.record(e["data"]["new_state"])
+            elif "entity_id" in e["data"].keys():
+                self.history.remove(e["data"]["entity_id"])
+
+        if e.get("origin") == "RESYNC":
+            # Already applied to the mirror when the diff was taken.
+            return
+
+        match e["event_type"]:
+            case "state_changed":
+                if e["data"].get("new_state"):
+                    self.mirror.update(HassEntity(e["data"]["new_state"]))
+                elif "entity_id" in e["data"].keys():
+                    self.mirror.remove(e["data"]["entity_id"])
+            case "service_registered":
+                self.catalog.invalidate(
+                    e["data"]["domain"], e["data"].get("service"))
+            case "service_removed":
+                self.catalog.remove(e["data"]["domain"], e["data"]["service"])
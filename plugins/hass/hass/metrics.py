@@ -0,0 +1,145 @@
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Optional
+
+# Exponential bucket bounds in seconds, from 10µs to roughly 170s.
+BUCKETS = [0.00001 * (2 ** i) for i in range(25)]
+
+# Transforms observe from worker threads next to the loop.
+_lock = threading.Lock()
+
+
+class Histogram:
+    __slots__ = ("counts", "count", "total", "min", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def observe(self, value: float):
+        with _lock:
+            self.counts[bisect_left(BUCKETS, value)] += 1
+            self.count += 1
+            self.total += value
+            self.min = value if self.min == None else min(self.min, value)
+            self.max = value if self.max == None else max(self.max, value)
+
+    def merge(self, other: "Histogram"):
+        if other.count == 0:
+            return
+        with _lock:
+            self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+            self.count += other.count
+            self.total += other.total
+            self.min = other.min if self.min == None else min(self.min, other.min)
+            self.max = other.max if self.max == None else max(self.max, other.max)
+
+    def percentile(self, p: float) -> Optional[float]:
+        # Upper bound of the bucket holding the percentile, capped at max.
+        if self.count == 0:
+            return None
+        target = p * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target and count > 0:
+                return min(BUCKETS[index], self.max) if index < len(BUCKETS) else self.max
+        return self.max
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count > 0 else None,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99),
+        }
+
+
+class Timer:
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+class Metrics:
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.reset()
+
+    def reset(self):
+        self.started = time.monotonic()
+        self.histograms: dict[str, Histogram] = {}
+        self.counters: dict[str, int] = {}
+        self.gauges: dict[str, float] = {}
+
+    def histogram(self, name: str) -> Histogram:
+        histogram = self.histograms.get(name)
+        if histogram == None:
+            with _lock:
+                histogram = self.histograms.setdefault(name, Histogram())
+        return histogram
+
+    def merge(self, histograms: dict[str, Histogram]):
+        # Adds what worker processes measured.
+        for name, histogram in histograms.items():
+            self.histogram(name).merge(histogram)
+
+    def timer(self, name: str) -> Timer | NullTimer:
+        if not self.enabled:
+            return NULL_TIMER
+        return Timer(self.histogram(name))
+
+    def observe(self, name: str, value: float):
+        if self.enabled:
+            self.histogram(name).observe(value)
+
+    def increment(self, name: str, value: int = 1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name: str, value: float):
+        if self.enabled:
+            self.gauges[name] = value
+
+    def snapshot(self) -> dict[str, Any]:
+        elapsed = time.monotonic() - self.started
+        return {
+            "enabled": self.enabled,
+            "elapsed": elapsed,
+            "histograms": {k: v.snapshot() for k, v in list(self.histograms.items())},
+            "counters": dict(self.counters),
+            "rates": {k: v / elapsed for k, v in self.counters.items()} if elapsed > 0 else {},
+            "gauges": dict(self.gauges),
+        }
+
+
+metrics = Metrics()
@@ -0,0 +1,228 @@
+import datetime
+import time
+from collections.abc import Iterator
+from typing import Any, Optional
+from haus_utils import PluginEntity
+from hass_websocket_client.models import HassEntity
+from hass_websocket_client.client import HassEvent
+
+from .transformers import EntityTransformer
+
+
+class StateMirror:
+    INDEXES = {
+        "domain": lambda state: state["entity_id"].partition(".")[0],
+        "device_class": lambda state: state["attributes"].get("device_class"),
+        "unit": lambda state: state["attributes"].get("unit_of_measurement"),
+        "state": lambda state: state.get("state"),
+    }
+
+    def __init__(self, resync_interval: float = 0, namespace: str = ""):
+        self.resync_interval = resync_interval
+        self.namespace = namespace
+        self.states: dict[str, HassEntity] = {}
+        self.entities: dict[str, PluginEntity] = {}
+        self.indexes: dict[str, dict[Any, set[str]]] = {
+            k: {} for k in self.INDEXES.keys()}
+        self.synced_at: Optional[float] = None
+        self.touched: Optional[set[str]] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self.synced_at != None
+
+    @property
+    def stale(self) -> bool:
+        if not self.loaded:
+            return True
+        if self.resync_interval <= 0:
+            return False
+        return time.monotonic() - self.synced_at >= self.resync_interval
+
+    @staticmethod
+    def changed(old: HassEntity, new: HassEntity) -> bool:
+        # last_updated moves on every state or attribute change, the context
+        # id catches writes that landed within the same timestamp.
+        if old.get("last_updated") and new.get("last_updated"):
+            return old["last_updated"] != new["last_updated"] or (old.get("context") or {}).get("id") != (new.get("context") or {}).get("id")
+        return old != new
+
+    @staticmethod
+    def updated_at(state: HassEntity) -> Optional[datetime.datetime]:
+        try:
+            return datetime.datetime.fromisoformat(state["last_updated"])
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    @classmethod
+    def older(cls, state: HassEntity, than: HassEntity) -> bool:
+        updated, reference = cls.updated_at(state), cls.updated_at(than)
+        if updated == None or reference == None:
+            return False
+        return updated < reference
+
+    def outdated(self, state: HassEntity) -> bool:
+        # A state that is not newer than the mirrored one, such as an event
+        # buffered before a resync that already applied a later state.
+        current = self.states.get(state["entity_id"])
+        if current == None or not current.get("last_updated") or not state.get("last_updated"):
+            return False
+        return self.older(state, current) or not self.changed(current, state)
+
+    def begin_sync(self):
+        # Entities changed by live events from here on were seen after the
+        # fetch started, so the fetched states cannot override them.
+        self.touched = set()
+
+    def end_sync(self):
+        self.touched = None
+
+    def reconcile(self, states: list[HassEntity]) -> dict[str, HassEntity]:
+        # Events and fetches travel on different connections, so a fetched
+        # state may be older than what live events already mirrored. The
+        # newer state wins per entity, and entities added or removed by live
+        # events during the fetch stay that way.
+        touched = self.touched or set()
+        result = {}
+        for state in states:
+            entity_id = state["entity_id"]
+            current = self.states.get(entity_id)
+            if current == None:
+                if not entity_id in touched:
+                    result[entity_id] = state
+            elif current is state or not self.older(state, current):
+                result[entity_id] = state
+            else:
+                result[entity_id] = current
+        for entity_id in touched:
+            if entity_id in self.states and not entity_id in result:
+                result[entity_id] = self.states[entity_id]
+        return result
+
+    def diff(self, states: list[HassEntity]) -> list[HassEvent]:
+        # Synthetic state_changed events turning the mirrored states into
+        # the given ones.
+        fired = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        current = self.reconcile(states)
+        events = []
+        for entity_id, state in current.items():
+            old = self.states.get(entity_id)
+            if old == None or self.changed(old, state):
+                events.append(HassEvent(event_type="state_changed", data={
+                    "entity_id": entity_id, "old_state": old, "new_state": state}, origin="RESYNC", time_fired=fired, context=state.get("context")))
+        for entity_id, old in self.states.items():
+            if not entity_id in current:
+                events.append(HassEvent(event_type="state_changed", data={
+                    "entity_id": entity_id, "old_state": old, "new_state": None}, origin="RESYNC", time_fired=fired, context=None))
+        return events
+
+    def load(self, states: list[HassEntity]):
+        # Keep already transformed entities whose raw state did not change
+        # since the last sync, so a periodic resync is not a full re-transform.
+        previous = self.states
+        self.states = self.reconcile(states)
+        for entity_id in previous.keys():
+            if not entity_id in self.states:
+                EntityTransformer.forget(self.namespace + entity_id)
+        self.entities = {
+            k: v
+            for k, v in self.entities.items()
+            if k in self.states and previous.get(k) == self.states[k]
+        }
+        self.indexes = {k: {} for k in self.INDEXES.keys()}
+        for state in self.states.values():
+            self._index(state)
+        self.synced_at = time.monotonic()
+
+    def _index(self, state: HassEntity):
+        for name, key in self.INDEXES.items():
+            value = key(state)
+            if isinstance(value, (str, int, float, bool)):
+                self.indexes[name].setdefault(
+                    value, set()).add(state["entity_id"])
+
+    def _unindex(self, state: HassEntity):
+        for name, key in self.INDEXES.items():
+            value = key(state)
+            if isinstance(value, (str, int, float, bool)) and value in self.indexes[name]:
+                self.indexes[name][value].discard(state["entity_id"])
+                if len(self.indexes[name][value]) == 0:
+                    del self.indexes[name][value]
+
+    def update(self, state: HassEntity, entity: PluginEntity = None):
+        if self.touched != None:
+            self.touched.add(state["entity_id"])
+        if state["entity_id"] in self.states:
+            self._unindex(self.states[state["entity_id"]])
+        self.states[state["entity_id"]] = state
+        self._index(state)
+        if entity:
+            self.entities[state["entity_id"]] = entity
+        else:
+            self.entities.pop(state["entity_id"], None)
+
+    def cache(self, state: HassEntity, entity: PluginEntity):
+        # Events may be transformed after newer states were already mirrored,
+        # so only keep the entity if it still matches the mirrored state.
+        if self.states.get(state["entity_id"]) == state:
+            self.entities[state["entity_id"]] = entity
+
+    def remove(self, entity_id: str):
+        if self.touched != None:
+            self.touched.add(entity_id)
+        if entity_id in self.states:
+            self._unindex(self.states.pop(entity_id))
+        self.entities.pop(entity_id, None)
+        EntityTransformer.forget(self.namespace + entity_id)
+
+    def query(self, **criteria: Optional[str | list[str]]) -> list[str]:
+        # Each criterion names an index and one or more accepted values.
+        # Values within a criterion are OR-ed, criteria are AND-ed.
+        matches: list[set[str]] = []
+        for name, values in criteria.items():
+            if values == None:
+                continue
+            if not name in self.indexes:
+                raise KeyError(name)
+            matches.append(set().union(
+                *[self.indexes[name].get(i, set()) for i in ([values] if type(values) == str else values)]))
+
+        if len(matches) == 0:
+            return list(self.states.keys())
+        matches.sort(key=len)
+        result = matches[0].intersection(*matches[1:])
+        return sorted(result)
+
+    def entity(self, entity_id: str, cache: bool = True) -> Optional[PluginEntity]:
+        if not entity_id in self.entities:
+            if not entity_id in self.states:
+                return None
+            entity = EntityTransformer.transform(
+                self.states[entity_id], namespace=self.namespace)
+            if not cache:
+                return entity
+            self.entities[entity_id] = entity
+        return self.entities[entity_id]
+
+    def keys(self, ids: list[str] = None) -> list[str]:
+        if ids == None:
+            return list(self.states.keys())
+        return [i for i in dict.fromkeys(ids) if i in self.states]
+
+    def uncached(self, ids: list[str] = None) -> list[HassEntity]:
+        return [self.states[i] for i in self.keys(ids) if not i in self.entities]
+
+    def get(self, ids: list[str] = None) -> list[PluginEntity]:
+        if ids == None:
+            return [self.entity(i) for i in self.states.keys()]
+        return [self.entity(i) for i in dict.fromkeys(ids) if i in self.states]
+
+    def chunks(self, ids: list[str] = None, size: int = 500) -> Iterator[list[PluginEntity]]:
+        # Transforms lazily and does not grow the entity cache, so only one
+        # chunk of newly transformed entities is alive at a time.
+        keys = self.keys(ids)
+        size = max(1, size)
+        for start in range(0, len(keys), size):
+            chunk = [self.entity(i, cache=False)
+                     for i in keys[start:start + size]]
+            yield [i for i in chunk if i]
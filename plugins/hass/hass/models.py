@@ -0,0 +1,37 @@
+from functools import lru_cache
+from typing import Any, TypeVar
+from haus_utils import DisplayData
+from pydantic import BaseModel
+
+Model = TypeVar("Model", bound=BaseModel)
+
+
+@lru_cache(maxsize=8192)
+def _shared_display(fields: tuple[tuple[str, Any], ...]) -> DisplayData:
+    return DisplayData.model_construct(**dict(fields))
+
+
+class ModelBuilder:
+    # Trusted mode skips pydantic validation for models built from input our
+    # own transformers already classified, and hands out shared DisplayData
+    # instances. Consumers must treat trusted models as read-only.
+    trusted = False
+
+    @classmethod
+    def build(cls, model: type[Model], **fields: Any) -> Model:
+        if cls.trusted:
+            return model.model_construct(**fields)
+        return model(**fields)
+
+    @classmethod
+    def display(cls, **fields: Any) -> DisplayData:
+        if cls.trusted:
+            try:
+                return _shared_display(tuple(fields.items()))
+            except TypeError:
+                return DisplayData.model_construct(**fields)
+        return DisplayData(**fields)
+
+
+build = ModelBuilder.build
+display = ModelBuilder.display
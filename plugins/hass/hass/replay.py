@@ -0,0 +1,99 @@
+import asyncio
+from collections import deque
+from itertools import islice
+from secrets import token_urlsafe
+from typing import Any, Optional
+from haus_utils import PluginEvent
+
+
+class EventLog:
+    # Ring buffer of recent events numbered by a monotonically increasing
+    # sequence. Readers keep a cursor (the last sequence they delivered).
+    # The writer never waits for readers: it is what keeps the mirror and
+    # history current, so a reader that falls behind the buffer is resynced
+    # instead. Event ids are "<epoch>:<sequence>" with a random epoch per
+    # log, so ids from another run never resolve.
+    def __init__(self, size: int = 1000):
+        self.size = max(1, size)
+        self.epoch = token_urlsafe(6)
+        self.events: deque[tuple[PluginEvent, Optional[float]]] = deque()
+        self.sequence = 0
+        self.cursors: dict[int, int] = {}
+        self.closed = False
+        self.error: Optional[BaseException] = None
+        self._changed = asyncio.Event()
+        self._next_reader = 0
+
+    @property
+    def first(self) -> int:
+        return self.sequence - len(self.events) + 1
+
+    def covers(self, sequence: int) -> bool:
+        return self.first - 1 <= sequence <= self.sequence
+
+    def id(self, sequence: int) -> str:
+        return self.epoch + ":" + str(sequence)
+
+    def position(self, id: Any) -> Optional[int]:
+        # Sequence of an id handed out by this log, None for anything else.
+        epoch, sep, sequence = str(id).rpartition(":")
+        if not sep or epoch != self.epoch or not sequence.isdigit():
+            return None
+        return int(sequence)
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait(self):
+        await self._changed.wait()
+
+    def append(self, event: PluginEvent, fired: float = None) -> int:
+        # fired is when HA fired the source event, kept to measure lag when
+        # the event is finally delivered.
+        self.sequence += 1
+        event.id = self.id(self.sequence)
+        self.events.append((event, fired))
+        if len(self.events) > self.size:
+            self.events.popleft()
+        self._notify()
+        return self.sequence
+
+    def open(self):
+        self.closed = False
+        self.error = None
+
+    def close(self, error: BaseException = None):
+        self.closed = True
+        self.error = error
+        self._notify()
+
+    def subscribe(self, cursor: int) -> int:
+        self._next_reader += 1
+        self.cursors[self._next_reader] = cursor
+        return self._next_reader
+
+    def unsubscribe(self, reader: int):
+        self.cursors.pop(reader, None)
+        self._notify()
+
+    def seek(self, reader: int, cursor: int):
+        self.cursors[reader] = cursor
+        self._notify()
+
+    def read(self, reader: int) -> Optional[list[tuple[int, PluginEvent, Optional[float]]]]:
+        # None means the reader's position was already evicted.
+        cursor = self.cursors[reader]
+        if not self.covers(cursor):
+            return None
+        return [
+            (cursor + 1 + index, event, fired)
+            for index, (event, fired) in enumerate(islice(self.events, cursor - self.first + 1, None))
+        ]
+
+    def backlog(self) -> int:
+        # Events the slowest active reader has yet to deliver.
+        return self.sequence - min(self.cursors.values(), default=self.sequence)
+
+    def ack(self, reader: int, sequence: int):
+        self.cursors[reader] = sequence
@@ -0,0 +1,77 @@
+import os
+import pickle
+import tempfile
+from functools import cache
+from importlib import metadata
+from typing import Any, Optional
+from haus_utils import EntityAction
+from hass_websocket_client.models import HassEntity, HassService
+
+# Bump whenever the layout below or the pickled models change shape, so an
+# incompatible snapshot is ignored instead of half-loaded.
+SNAPSHOT_VERSION = 3
+
+# Modules whose classes are pickled in the body. Their installed versions
+# are part of the header, so upgrading one invalidates the snapshot.
+PICKLED_MODULES = ["haus_utils", "hass_websocket_client", "pydantic"]
+
+
+@cache
+def library_versions() -> dict[str, Optional[str]]:
+    distributions = metadata.packages_distributions()
+    versions = {}
+    for module in PICKLED_MODULES:
+        try:
+            versions[module] = metadata.version(
+                distributions.get(module, [module])[0])
+        except metadata.PackageNotFoundError:
+            versions[module] = None
+    return versions
+
+
+class Snapshot:
+    def __init__(self, states: list[HassEntity], services: dict[str, HassService], actions: dict[str, EntityAction]):
+        self.states = states
+        self.services = services
+        self.actions = actions
+
+    @classmethod
+    def load(cls, path: str, server: str, namespace: str = "") -> Optional["Snapshot"]:
+        # The header is pickled separately so a snapshot from another server
+        # or version is rejected without unpickling the body.
+        try:
+            with open(path, "rb") as f:
+                header = pickle.load(f)
+                if header != cls.header(server, namespace):
+                    return None
+                body: dict[str, Any] = pickle.load(f)
+            return cls(body["states"], body["services"], body["actions"])
+        except Exception:
+            return None
+
+    @staticmethod
+    def header(server: str, namespace: str = "") -> dict[str, Any]:
+        return {"version": SNAPSHOT_VERSION, "server": server, "namespace": namespace, "libraries": library_versions()}
+
+    def dumps(self, server: str, namespace: str = "") -> bytes:
+        return pickle.dumps(self.header(server, namespace), protocol=pickle.HIGHEST_PROTOCOL) + pickle.dumps(
+            {"states": self.states, "services": self.services,
+                "actions": self.actions},
+            protocol=pickle.HIGHEST_PROTOCOL,
+        )
+
+    def save(self, path: str, server: str, namespace: str = ""):
+        self.write(path, self.dumps(server, namespace))
+
+    @staticmethod
+    def write(path: str, data: bytes):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, temp = tempfile.mkstemp(dir=directory, prefix=".snapshot-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp, path)
+        except:
+            os.unlink(temp)
+            raise
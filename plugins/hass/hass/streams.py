@@ -0,0 +1,83 @@
+import asyncio
+from collections.abc import AsyncGenerator, AsyncIterable
+from typing import Any
+
+
+async def merge_streams(*sources: AsyncIterable[Any], buffer: int = 64, auxiliary: list[AsyncIterable[Any]] = []) -> AsyncGenerator[Any, Any]:
+    # Interleaves several async iterables in arrival order. Ends when every
+    # source is exhausted and re-raises the first error raised by a source.
+    # Auxiliary sources are merged in but do not keep the stream alive.
+    queue: asyncio.Queue = asyncio.Queue(maxsize=buffer)
+    finished = object()
+
+    async def pump(source: AsyncIterable[Any], counted: bool):
+        try:
+            async for item in source:
+                await queue.put((item, None))
+            if counted:
+                await queue.put((finished, None))
+        except Exception as e:
+            await queue.put((finished, e))
+
+    tasks = [asyncio.create_task(pump(i, True)) for i in sources] + \
+        [asyncio.create_task(pump(i, False)) for i in auxiliary]
+    try:
+        remaining = len(sources)
+        while remaining > 0:
+            item, error = await queue.get()
+            if error:
+                raise error
+            if item is finished:
+                remaining -= 1
+                continue
+            yield item
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def fair_merge(*sources: AsyncIterable[Any], buffer: int = 64) -> AsyncGenerator[Any, Any]:
+    # Takes one item per ready source in turn, so a source delivering a
+    # burst cannot starve the others. A failing source is dropped and its
+    # error re-raised only once every other source has ended.
+    queues = [asyncio.Queue(maxsize=buffer) for _ in sources]
+    ready = asyncio.Event()
+    finished = object()
+
+    async def pump(source: AsyncIterable[Any], queue: asyncio.Queue):
+        try:
+            async for item in source:
+                await queue.put((item, None))
+                ready.set()
+            await queue.put((finished, None))
+        except Exception as e:
+            await queue.put((finished, e))
+        ready.set()
+
+    tasks = [asyncio.create_task(pump(i, q)) for i, q in zip(sources, queues)]
+    try:
+        active = list(queues)
+        error = None
+        while len(active) > 0:
+            if all([i.empty() for i in active]):
+                ready.clear()
+                await ready.wait()
+                continue
+
+            for queue in list(active):
+                if queue.empty():
+                    continue
+                item, e = queue.get_nowait()
+                if item is finished:
+                    active.remove(queue)
+                    error = error or e
+                    continue
+                yield item
+
+        if error:
+            raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
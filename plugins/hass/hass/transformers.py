@@ -1,8 +1,29 @@
+import hashlib
 import json
-from typing import Any
+import threading
+from collections import OrderedDict
+from collections.abc import Iterable
+from typing import Any, Optional
 from hass_websocket_client.models import HassEntity, HassService, HassServiceField, HassServiceTarget
 from haus_utils import *
 
+from .classify import classify_hinted, classify_value, classify_values
+from .metrics import metrics
+from .models import build, display
+
+
+class PropertyPlan:
+    # Shared by transforms on worker threads. Every field is replaced with a
+    # single assignment and never mutated in place, so readers see either
+    # the old or the new value. value_type is only a hint for resolve_value.
+    __slots__ = ("pid", "label", "value_type", "table")
+
+    def __init__(self, pid: str, label: str):
+        self.pid = pid
+        self.label = label
+        self.value_type: Optional[str] = None
+        self.table: Optional[tuple[dict, list[TablePropertyColumn]]] = None
+
 
 class EntityTransformer:
     ICON_MAP = {
@@ -53,177 +74,206 @@ class EntityTransformer:
         "translation_key",
     ]
 
+    # One plan per entity, replaced only when its set of keys changes, with
+    # least recently used entities evicted past PLAN_CACHE_SIZE. The default
+    # is meant to sit above the entity count of large installations, so it
+    # only ever evicts entities that went away. The mirror also forgets
+    # removed entities right away, but worker processes rely on the bound.
+    PLAN_CACHE_SIZE = 65536
+    _plans: OrderedDict[str, tuple[frozenset[str],
+                                   dict[str, Optional[PropertyPlan]]]] = OrderedDict()
+    # Bulk transforms may run on worker threads next to the event loop.
+    _plans_lock = threading.Lock()
+
     @classmethod
-    def transform(cls, entity: HassEntity) -> PluginEntity:
-        etype = entity["entity_id"].split(".")[0]
+    def transform(cls, entity: HassEntity, keys: Iterable[str] = None, namespace: str = "") -> PluginEntity:
+        with metrics.timer("transform.entity"):
+            return build(
+                PluginEntity,
+                id=namespace + entity["entity_id"],
+                plugin="hass",
+                type=entity["entity_id"].split(".")[0],
+                display=cls.entity_display(entity),
+                properties=EntityTransformer.generic_property_transform(
+                    entity, keys=keys, namespace=namespace),
+            )
 
-        return PluginEntity(
-            id=entity["entity_id"],
-            plugin="hass",
-            type=etype,
-            display=DisplayData(
-                label=entity["attributes"].get(
-                    "friendly_name", entity["entity_id"].replace(
-                        "_", " ").title()
-                ),
-                icon=cls.ICON_MAP.get(etype.lower(), "hexagon"),
+    @classmethod
+    def entity_display(cls, entity: HassEntity) -> DisplayData:
+        etype = entity["entity_id"].split(".")[0]
+        return display(
+            label=entity["attributes"].get(
+                "friendly_name", entity["entity_id"].replace(
+                    "_", " ").title()
             ),
-            properties=EntityTransformer.generic_property_transform(entity),
+            icon=cls.ICON_MAP.get(etype.lower(), "hexagon"),
         )
 
+    @classmethod
+    def delta_transform(cls, old: HassEntity, new: HassEntity, namespace: str = "") -> tuple[PluginEntity, list[str]]:
+        old_values = dict(state=old["state"], **old["attributes"])
+        new_values = dict(state=new["state"], **new["attributes"])
+        changed = [
+            k for k, v in new_values.items()
+            if not k in old_values or old_values[k] != v
+        ]
+        removed = [
+            namespace + new["entity_id"] + "." + k
+            for k in old_values.keys()
+            if not k in new_values and not k.lower() in cls.DENIED_KEYS
+        ]
+        return cls.transform(new, keys=changed, namespace=namespace), removed
+
     @staticmethod
     def parse_value(
         value: Any,
     ) -> Union[str, bool, int, float, None, datetime.datetime]:
-        if type(value) == dict:
-            return json.dumps(value), "string"
-
-        if type(value) == list:
-            return value, "list"
-
-        if type(value) == int:
-            return value, "number"
-
-        if type(value) == float:
-            return value, "number"
-
-        if type(value) != str:
-            value = str(value)
+        return classify_value(value)
 
-        if value.lower() in ["off", "false", "no"]:
-                return False, "boolean"
-        if value.lower() in ["on", "true", "yes"]:
-            return True, "boolean"
+    @classmethod
+    def transform_plan(cls, entity_id: str, keys: Iterable[str]) -> dict[str, Optional[PropertyPlan]]:
+        keys = frozenset(keys)
+        with cls._plans_lock:
+            cached = cls._plans.get(entity_id)
+            if cached != None:
+                cls._plans.move_to_end(entity_id)
+                if cached[0] == keys:
+                    return cached[1]
+
+            # Keys the entity still has keep their steps and type hints.
+            plan = {} if cached == None else {
+                k: v for k, v in cached[1].items() if k in keys}
+            cls._plans[entity_id] = (keys, plan)
+            while len(cls._plans) > cls.PLAN_CACHE_SIZE:
+                cls._plans.popitem(last=False)
+            return plan
 
-        try:
-            return float(value), "number"
-        except:
-            pass
+    @classmethod
+    def forget(cls, entity_id: str):
+        with cls._plans_lock:
+            cls._plans.pop(entity_id, None)
 
-        try:
-            return datetime.datetime.fromisoformat(value), "datetime"
-        except:
-            pass
+    @staticmethod
+    def resolve_value(pid: str, value: Any, hint: str = None) -> tuple[Any, str]:
+        parsed_value, value_type = classify_hinted(value, hint)
+        if value_type == "list" and len(parsed_value) > 0:
+            if "rgb" in pid and len(parsed_value) == 3 and all([type(i) == int for i in parsed_value]):
+                return "rgb(" + ", ".join([str(i) for i in parsed_value]) + ")", "color"
+            if type(parsed_value[0]) == dict:
+                return parsed_value, "table"
+        return parsed_value, value_type
 
-        return value, "string"
+    @staticmethod
+    def build_property(plan: PropertyPlan, value: Any, value_type: str) -> ENTITY_PROPERTIES:
+        match value_type:
+            case "boolean" | "bool":
+                return build(
+                    BooleanEntityProperty,
+                    id=plan.pid,
+                    display=display(label=plan.label, icon="toggle-right"),
+                    value=value,
+                )
+            case "number":
+                return build(
+                    NumberEntityProperty,
+                    id=plan.pid,
+                    display=display(label=plan.label, icon="number"),
+                    value=value,
+                )
+            case "datetime":
+                return build(
+                    DateEntityProperty,
+                    id=plan.pid,
+                    display=display(label=plan.label, icon="calendar-time"),
+                    value=value,
+                )
+            case "string":
+                return build(
+                    StringEntityProperty,
+                    id=plan.pid,
+                    display=display(label=plan.label, icon="text-size"),
+                    value=value,
+                )
+            case "color":
+                return build(
+                    ColorEntityProperty,
+                    id=plan.pid,
+                    display=display(label=plan.label, icon="list"),
+                    value=value,
+                    hasAlpha=False
+                )
+            case "table":
+                try:
+                    table = plan.table
+                    if table == None or table[0] != value[0]:
+                        table = (value[0], [
+                            build(
+                                TablePropertyColumn,
+                                key=k,
+                                value_type=value_type,
+                            )
+                            for k, (_, value_type) in classify_values(value[0]).items()
+                        ])
+                        plan.table = table
+                    return TableEntityProperty(
+                        id=plan.pid,
+                        display=display(label=plan.label, icon="table"),
+                        value=value,
+                        columns=table[1],
+                    )
+                except:
+                    plan.table = None
+                    return build(
+                        ListEntityProperty,
+                        id=plan.pid,
+                        display=display(label=plan.label, icon="list"),
+                        value=value,
+                    )
+            case "list":
+                return build(
+                    ListEntityProperty,
+                    id=plan.pid,
+                    display=display(label=plan.label, icon="list"),
+                    value=value,
+                )
+            case _:
+                return build(
+                    StringEntityProperty,
+                    id=plan.pid,
+                    display=display(label=plan.label, icon="text-size"),
+                    value=str(value),
+                )
 
     @staticmethod
-    def generic_property_transform(entity: HassEntity) -> dict[str, ENTITY_PROPERTIES]:
+    def generic_property_transform(entity: HassEntity, keys: Iterable[str] = None, namespace: str = "") -> dict[str, ENTITY_PROPERTIES]:
         props = {}
-        for key, value in dict(state=entity["state"], **entity["attributes"]).items():
-            if key.lower() in EntityTransformer.DENIED_KEYS:
+        entity_id = namespace + entity["entity_id"]
+        values = dict(state=entity["state"], **entity["attributes"])
+        plan = EntityTransformer.transform_plan(entity_id, values.keys())
+
+        for key in values.keys() if keys == None else keys:
+            if not key in values:
                 continue
 
-            parsed_value, value_type = EntityTransformer.parse_value(value)
-            pid = entity["entity_id"] + "." + key
-            match value_type:
-                case "boolean":
-                    props[pid] = BooleanEntityProperty(
-                        id=pid,
-                        display=DisplayData(
-                            label=key.replace("_", " ").title(), icon="toggle-right"
-                        ),
-                        value=parsed_value,
-                    )
-                    continue
-                case "bool":
-                    props[pid] = BooleanEntityProperty(
-                        id=pid,
-                        display=DisplayData(
-                            label=key.replace("_", " ").title(), icon="toggle-right"
-                        ),
-                        value=parsed_value,
-                    )
-                    continue
-                case "number":
-                    props[pid] = NumberEntityProperty(
-                        id=pid,
-                        display=DisplayData(
-                            label=key.replace("_", " ").title(), icon="number"
-                        ),
-                        value=parsed_value,
-                    )
-                    continue
-                case "datetime":
-                    props[pid] = DateEntityProperty(
-                        id=pid,
-                        display=DisplayData(
-                            label=key.replace("_", " ").title(), icon="calendar-time"
-                        ),
-                        value=parsed_value,
-                    )
-                    continue
-                case "string":
-                    props[pid] = StringEntityProperty(
-                        id=pid,
-                        display=DisplayData(
-                            label=key.replace("_", " ").title(), icon="text-size"
-                        ),
-                        value=parsed_value,
-                    )
-                    continue
-                case "list":
-                    if len(parsed_value) == 0:
-                        props[pid] = ListEntityProperty(
-                            id=pid,
-                            display=DisplayData(
-                                label=key.replace("_", " ").title(), icon="list"
-                            ),
-                            value=parsed_value,
-                        )
-                        continue
-
-                    if "rgb" in pid and len(parsed_value) == 3 and all([type(i) == int for i in parsed_value]):
-                        props[pid] = ColorEntityProperty(
-                            id=pid,
-                            display=DisplayData(
-                                label=key.replace("_", " ").title(), icon="list"
-                            ),
-                            value=f"rgb({', '.join([str(i)
-                                                    for i in parsed_value])})",
-                            hasAlpha=False
-                        )
-                        continue
-
-                    if type(parsed_value[0]) == dict:
-                        try:
-                            props[pid] = TableEntityProperty(
-                                id=pid,
-                                display=DisplayData(
-                                    label=key.replace("_", " ").title(),
-                                    icon="table",
-                                ),
-                                value=parsed_value,
-                                columns=[
-                                    TablePropertyColumn(
-                                        key=k,
-                                        value_type=EntityTransformer.parse_value(v)[
-                                            1],
-                                    )
-                                    for k, v in parsed_value[0].items()
-                                ],
-                            )
-                            continue
-                        except:
-                            pass
-
-                    props[pid] = ListEntityProperty(
-                        id=pid,
-                        display=DisplayData(
-                            label=key.replace("_", " ").title(), icon="list"
-                        ),
-                        value=parsed_value,
-                    )
-                    continue
-
-                case _:
-                    props[pid] = StringEntityProperty(
-                        id=pid,
-                        display=DisplayData(
-                            label=key.replace("_", " ").title(), icon="text-size"
-                        ),
-                        value=str(parsed_value),
-                    )
+            if key in plan:
+                step = plan[key]
+            else:
+                step = None if key.lower() in EntityTransformer.DENIED_KEYS else PropertyPlan(
+                    entity_id + "." + key, key.replace("_", " ").title())
+                # transform_plan copies plans under the lock, possibly for
+                # the same entity on another thread.
+                with EntityTransformer._plans_lock:
+                    step = plan.setdefault(key, step)
+
+            if step == None:
+                continue
+
+            parsed_value, value_type = EntityTransformer.resolve_value(
+                step.pid, values[key], hint=step.value_type)
+            if step.value_type != value_type:
+                step.value_type = value_type
+            props[step.pid] = EntityTransformer.build_property(
+                step, parsed_value, value_type)
         return props
 
 
@@ -239,13 +289,46 @@ class ActionTransformer:
         "persistent_notification": "bell"
     }
 
+    # Transformed services and fields keyed by a hash of their definition.
+    # Identical schemas (the same light fields across integrations, or an
+    # unchanged service after a refresh) are transformed once and shared.
+    SCHEMA_CACHE_SIZE = 4096
+    _services: OrderedDict[str, EntityAction] = OrderedDict()
+    _fields: OrderedDict[str, ENTITY_ACTION_FIELDS] = OrderedDict()
+    _lock = threading.Lock()
+
+    @staticmethod
+    def schema_hash(*parts: Any) -> str:
+        return hashlib.blake2b(json.dumps(parts, sort_keys=True, default=str).encode(), digest_size=16).hexdigest()
+
     @classmethod
-    def transform(cls, domain: str, service: str, data: HassService) -> EntityAction:
-        return EntityAction(
-            id=domain + "." + service,
+    def _cached(cls, cache: OrderedDict, key: str, factory) -> Any:
+        with cls._lock:
+            if key in cache:
+                cache.move_to_end(key)
+                return cache[key]
+
+        # Built outside the lock, services build their fields through here.
+        value = factory()
+        with cls._lock:
+            cache[key] = value
+            if len(cache) > cls.SCHEMA_CACHE_SIZE:
+                cache.popitem(last=False)
+        return value
+
+    @classmethod
+    def transform(cls, domain: str, service: str, data: HassService, namespace: str = "") -> EntityAction:
+        with metrics.timer("transform.action"):
+            return cls._cached(cls._services, cls.schema_hash(namespace, domain, service, data), lambda: cls.transform_service(domain, service, data, namespace=namespace))
+
+    @classmethod
+    def transform_service(cls, domain: str, service: str, data: HassService, namespace: str = "") -> EntityAction:
+        return build(
+            EntityAction,
+            id=namespace + domain + "." + service,
             plugin="hass",
             category=domain,
-            display=DisplayData(
+            display=display(
                 label=data["name"] if len(data["name"]) > 0 else " ".join(
                     [i.capitalize() for i in service.split("_")]),
                 sub_label=data["description"] if "description" in data.keys() and len(
@@ -254,8 +337,8 @@ class ActionTransformer:
                     domain + "." + service, ActionTransformer.ICON_MAP.get(domain, "settings-2"))
             ),
             target_types=[domain] if data.get("target") else None,
-            fields={k: v for k, v in {k: ActionTransformer.transform_field(
-                k, v) for k, v in data["fields"].items()}.items() if v}
+            fields={k: v for k, v in {k: cls._cached(cls._fields, cls.schema_hash(k, v), lambda: ActionTransformer.transform_field(
+                k, v)) for k, v in data["fields"].items()}.items() if v}
         )
 
     @staticmethod
@@ -263,9 +346,10 @@ class ActionTransformer:
         selector_type = list(field.get("selector").keys())[0]
         selector_data = field["selector"][selector_type]
         if key == "date" and selector_type == "text":
-            return DateActionField(
+            return build(
+                DateActionField,
                 key=key,
-                display=DisplayData(label=field.get("name", " ".join(
+                display=display(label=field.get("name", " ".join(
                     [i.capitalize() for i in key.split("_")])), sub_label=field.get("description"), icon="calendar"),
                 advanced=field.get("advanced", False),
                 default=field.get("default"),
@@ -276,9 +360,10 @@ class ActionTransformer:
             )
 
         if key == "datetime" and selector_type == "text":
-            return DateTimeActionField(
+            return build(
+                DateTimeActionField,
                 key=key,
-                display=DisplayData(label=field.get("name", " ".join(
+                display=display(label=field.get("name", " ".join(
                     [i.capitalize() for i in key.split("_")])), sub_label=field.get("description"), icon="calendar-clock"),
                 advanced=field.get("advanced", False),
                 default=field.get("default"),
@@ -289,9 +374,10 @@ class ActionTransformer:
             )
 
         if key == "rgb_color" and selector_type == "object":
-            return ColorActionField(
+            return build(
+                ColorActionField,
                 key=key,
-                display=DisplayData(label=field.get("name", " ".join(
+                display=display(label=field.get("name", " ".join(
                     [i.capitalize() for i in key.split("_")])), sub_label=field.get("description"), icon="color-swatch"),
                 advanced=field.get("advanced", False),
                 default=field.get("default"),
@@ -301,9 +387,10 @@ class ActionTransformer:
 
         match selector_type:
             case "text":
-                return StringActionField(
+                return build(
+                    StringActionField,
                     key=key,
-                    display=DisplayData(label=field.get("name", " ".join(
+                    display=display(label=field.get("name", " ".join(
                         [i.capitalize() for i in key.split("_")])), sub_label=field.get("description"), icon="cursor-text"),
                     advanced=field.get("advanced", False),
                     default=field.get("default"),
@@ -312,23 +399,25 @@ class ActionTransformer:
                 )
 
             case "select":
-                return SelectionActionField(
+                return build(
+                    SelectionActionField,
                     key=key,
-                    display=DisplayData(label=field.get("name", " ".join(
+                    display=display(label=field.get("name", " ".join(
                         [i.capitalize() for i in key.split("_")])), sub_label=field.get("description"), icon="select"),
                     advanced=field.get("advanced", False),
                     default=field.get("default"),
                     required=field.get("required", False),
-                    options=[SelectionActionOptions(value=i, label=" ".join(
-                        [j.capitalize() for j in i.split("_")])) if type(i) != dict else SelectionActionOptions(value=i["value"], label=i["label"]) for i in selector_data.get("options", [])],
+                    options=[build(SelectionActionOptions, value=i, label=" ".join(
+                        [j.capitalize() for j in i.split("_")])) if type(i) != dict else build(SelectionActionOptions, value=i["value"], label=i["label"]) for i in selector_data.get("options", [])],
                     multi=False,
                     example=field.get("example")
                 )
 
             case "time":
-                return TimeActionField(
+                return build(
+                    TimeActionField,
                     key=key,
-                    display=DisplayData(label=field.get("name", " ".join(
+                    display=display(label=field.get("name", " ".join(
                         [i.capitalize() for i in key.split("_")])), sub_label=field.get("description"), icon="clock"),
                     advanced=field.get("advanced", False),
                     default=field.get("default"),
@@ -339,9 +428,10 @@ class ActionTransformer:
                 )
 
             case "object":
-                return JSONActionField(
+                return build(
+                    JSONActionField,
                     key=key,
-                    display=DisplayData(label=field.get("name", " ".join(
+                    display=display(label=field.get("name", " ".join(
                         [i.capitalize() for i in key.split("_")])), sub_label=field.get("description"), icon="json"),
                     advanced=field.get("advanced", False),
                     default=field.get("default"),
@@ -350,9 +440,10 @@ class ActionTransformer:
                 )
 
             case "number":
-                return NumberActionField(
+                return build(
+                    NumberActionField,
                     key=key,
-                    display=DisplayData(label=field.get("name", " ".join(
+                    display=display(label=field.get("name", " ".join(
                         [i.capitalize() for i in key.split("_")])), sub_label=field.get("description"), icon="number"),
                     advanced=field.get("advanced", False),
                     default=field.get("default"),
@@ -365,9 +456,10 @@ class ActionTransformer:
                 )
 
             case "boolean":
-                return BooleanActionField(
+                return build(
+                    BooleanActionField,
                     key=key,
-                    display=DisplayData(label=field.get("name", " ".join(
+                    display=display(label=field.get("name", " ".join(
                         [i.capitalize() for i in key.split("_")])), sub_label=field.get("description"), icon="toggle-left"),
                     advanced=field.get("advanced", False),
                     default=field.get("default"),
@@ -384,36 +476,37 @@ class ActionTransformer:
                     if "service" in selector_data.keys():
                         pfx += selector_data["service"] + "."
 
-                return EntitySelectorActionField(key=key,
-                                                 display=DisplayData(label=field.get("name", " ".join(
-                                                     [i.capitalize() for i in key.split("_")])), sub_label=field.get("description"), icon="category"),
-                                                 advanced=field.get(
-                                                     "advanced", False),
-                                                 default=field.get("default"),
-                                                 required=field.get(
-                                                     "required", False),
-                                                 prefix=[pfx.strip(".")] if len(
-                                                     pfx) > 0 else [],
-                                                 example=field.get("example")
-                                                 )
+                return build(
+                    EntitySelectorActionField,
+                    key=key,
+                    display=display(label=field.get("name", " ".join(
+                        [i.capitalize() for i in key.split("_")])), sub_label=field.get("description"), icon="category"),
+                    advanced=field.get("advanced", False),
+                    default=field.get("default"),
+                    required=field.get("required", False),
+                    prefix=[pfx.strip(".")] if len(
+                        pfx) > 0 else [],
+                    example=field.get("example")
+                )
 
             case "conversation_agent":
-                return EntitySelectorActionField(key=key,
-                                                 display=DisplayData(label=field.get("name", " ".join(
-                                                     [i.capitalize() for i in key.split("_")])), sub_label=field.get("description"), icon="category"),
-                                                 advanced=field.get(
-                                                     "advanced", False),
-                                                 default=field.get("default"),
-                                                 required=field.get(
-                                                     "required", False),
-                                                 prefix=["conversation_agent"],
-                                                 example=field.get("example")
-                                                 )
+                return build(
+                    EntitySelectorActionField,
+                    key=key,
+                    display=display(label=field.get("name", " ".join(
+                        [i.capitalize() for i in key.split("_")])), sub_label=field.get("description"), icon="category"),
+                    advanced=field.get("advanced", False),
+                    default=field.get("default"),
+                    required=field.get("required", False),
+                    prefix=["conversation_agent"],
+                    example=field.get("example")
+                )
 
             case "color_temp":
-                return NumberActionField(
+                return build(
+                    NumberActionField,
                     key=key,
-                    display=DisplayData(label=field.get("name", " ".join(
+                    display=display(label=field.get("name", " ".join(
                         [i.capitalize() for i in key.split("_")])), sub_label=field.get("description"), icon="color-swatch"),
                     advanced=field.get("advanced", False),
                     default=field.get("default"),
@@ -428,9 +521,10 @@ class ActionTransformer:
                 )
 
             case "color_rgb":
-                return ColorActionField(
+                return build(
+                    ColorActionField,
                     key=key,
-                    display=DisplayData(label=field.get("name", " ".join(
+                    display=display(label=field.get("name", " ".join(
                         [i.capitalize() for i in key.split("_")])), sub_label=field.get("description"), icon="color-swatch"),
                     advanced=field.get("advanced", False),
                     default=field.get("default"),
@@ -442,9 +536,10 @@ class ActionTransformer:
                 return None
 
             case _:
-                return StringActionField(
+                return build(
+                    StringActionField,
                     key=key,
-                    display=DisplayData(label=field.get("name", " ".join(
+                    display=display(label=field.get("name", " ".join(
                         [i.capitalize() for i in key.split("_")])), sub_label=field.get("description"), icon="cursor-text"),
                     advanced=field.get("advanced", False),
                     default=field.get("default"),
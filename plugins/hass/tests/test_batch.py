@@ -0,0 +1,46 @@
+from hass.batch import ActionCall, group_calls
+
+
+def summary(calls: list[ActionCall]) -> list[tuple]:
+    return [(i.action_id, i.targets, i.fields, i.indices) for i in group_calls(calls)]
+
+
+def test_merges_distinct_targets_with_identical_fields():
+    assert summary([
+        ActionCall(action_id="light.turn_on", target="light.a", fields={"brightness": 10}),
+        ActionCall(action_id="light.turn_on", target="light.b", fields={"brightness": 10}),
+        ActionCall(action_id="light.turn_on", target="light.c", fields={"brightness": 20}),
+        ActionCall(action_id="light.turn_off", target="light.d"),
+    ]) == [
+        ("light.turn_on", ["light.a", "light.b"], {"brightness": 10}, [0, 1]),
+        ("light.turn_on", ["light.c"], {"brightness": 20}, [2]),
+        ("light.turn_off", ["light.d"], {}, [3]),
+    ]
+
+
+def test_repeated_target_is_called_again():
+    assert summary([
+        ActionCall(action_id="light.toggle", target="light.a"),
+        ActionCall(action_id="light.toggle", target="light.a"),
+        ActionCall(action_id="light.toggle", target="light.b"),
+    ]) == [
+        ("light.toggle", ["light.a"], {}, [0]),
+        ("light.toggle", ["light.a", "light.b"], {}, [1, 2]),
+    ]
+
+
+def test_untargeted_calls_are_not_merged():
+    assert summary([
+        ActionCall(action_id="scene.reload"),
+        ActionCall(action_id="scene.reload"),
+    ]) == [
+        ("scene.reload", [], {}, [0]),
+        ("scene.reload", [], {}, [1]),
+    ]
+
+
+def test_none_fields_are_dropped():
+    assert summary([
+        ActionCall(action_id="light.turn_on", target="light.a", fields={"brightness": None}),
+        ActionCall(action_id="light.turn_on", target="light.b"),
+    ]) == [("light.turn_on", ["light.a", "light.b"], {}, [0, 1])]
@@ -0,0 +1,66 @@
+from hass.catalog import ActionCatalog
+
+
+def service(name: str = "", **fields) -> dict:
+    return {"name": name, "description": "", "fields": fields}
+
+
+SERVICES = {
+    "light": {"turn_on": service("Turn on"), "turn_off": service("Turn off")},
+    "scene": {"apply": service()},
+}
+
+
+def test_load_and_get():
+    catalog = ActionCatalog()
+    assert catalog.stale
+    catalog.load(SERVICES)
+    assert not catalog.stale
+    assert [i.id for i in catalog.get()] == ["light.turn_on", "light.turn_off", "scene.apply"]
+    assert [i.id for i in catalog.get(["scene.apply", "missing"])] == ["scene.apply"]
+
+
+def test_reload_only_transforms_changed_services():
+    catalog = ActionCatalog()
+    catalog.load(SERVICES)
+    turn_on, apply = catalog.actions["light.turn_on"], catalog.actions["scene.apply"]
+
+    assert catalog.changed(SERVICES) == []
+    changed = {**SERVICES, "scene": {"apply": service("Apply scene")}}
+    assert [(d, s) for d, s, _ in catalog.changed(changed)] == [("scene", "apply")]
+
+    catalog.load(changed)
+    assert catalog.actions["light.turn_on"] is turn_on
+    assert catalog.actions["scene.apply"] is not apply
+    assert catalog.actions["scene.apply"].display.label == "Apply scene"
+
+
+def test_invalidate_marks_stale_and_retransforms():
+    catalog = ActionCatalog()
+    catalog.load(SERVICES)
+    turn_on, turn_off = catalog.actions["light.turn_on"], catalog.actions["light.turn_off"]
+
+    catalog.invalidate("light", "turn_on")
+    assert catalog.stale
+    assert [(d, s) for d, s, _ in catalog.changed(SERVICES)] == [("light", "turn_on")]
+
+    catalog.invalidate("light")
+    assert [(d, s) for d, s, _ in catalog.changed(SERVICES)] == [("light", "turn_on"), ("light", "turn_off")]
+    catalog.load(SERVICES)
+    assert not catalog.stale
+    # Identical schemas come back from the content-addressed cache.
+    assert catalog.actions["light.turn_off"] == turn_off
+
+
+def test_remove():
+    catalog = ActionCatalog()
+    catalog.load(SERVICES)
+    catalog.remove("scene", "apply")
+    assert [i.id for i in catalog.get()] == ["light.turn_on", "light.turn_off"]
+    assert not "scene" in catalog.domains
+
+
+def test_namespace_prefixes_ids():
+    catalog = ActionCatalog(namespace="north:")
+    catalog.load(SERVICES)
+    assert catalog.get(["light.turn_on"])[0].id == "north:light.turn_on"
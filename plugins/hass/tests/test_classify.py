@@ -0,0 +1,106 @@
+import datetime
+import json
+import math
+import random
+import string
+from typing import Any
+
+import pytest
+
+from hass.classify import classify_hinted, classify_value
+
+
+def reference_classify(value: Any) -> tuple[Any, str]:
+    # The try/except classifier classify_value replaced, kept verbatim as
+    # the reference the fast path has to agree with.
+    if type(value) == dict:
+        return json.dumps(value), "string"
+
+    if type(value) == list:
+        return value, "list"
+
+    if type(value) == int:
+        return value, "number"
+
+    if type(value) == float:
+        return value, "number"
+
+    if type(value) != str:
+        value = str(value)
+
+    if value.lower() in ["off", "false", "no"]:
+        return False, "boolean"
+    if value.lower() in ["on", "true", "yes"]:
+        return True, "boolean"
+
+    try:
+        return float(value), "number"
+    except:
+        pass
+
+    try:
+        return datetime.datetime.fromisoformat(value), "datetime"
+    except:
+        pass
+
+    return value, "string"
+
+
+CORPUS = [
+    "on", "off", "On", "OFF", "Yes", "TRUE", "no", "no ", "unavailable", "unknown", "home", "not_home",
+    "heat", "cool", "auto", "", "21.5", "-3", "1e-3", "1E5", "+.5", "5.", ".", " 12 ", "\t7\n", "5 ",
+    "inf", "-Infinity", "NaN", "nan1", "1_000", "1__0", "_1", "0x10", "1e", "e1", "1.2.3", "++1", "1 2",
+    "٣", "١٢.٥", "\x1c1\x1f", "\x0b5\x0c", "\xa05",
+    "2024-01-17T10:00:00+00:00", "2024-01-17T10:00:00Z", "2024-01-17", "20240117", "2024W03",
+    "2024-W03-2", "2024-01-17 10:00:00.123456", "2024-13-01", "2024-01-17T25:00", "2024", "10:00",
+    None, True, False, 0, 1, 1.5, [], [1, 2], [{"a": 1}], {"a": 1}, (1, 2),
+]
+
+
+def fuzz_corpus() -> list[str]:
+    rng = random.Random(5)
+    chars = string.digits + ".-+eE:TWZ _infatyINF \t"
+    values = ["".join(rng.choice(chars) for _ in range(rng.randint(0, 12)))
+              for _ in range(20000)]
+    # Every character up to CJK next to a digit, for the non-ASCII and
+    # whitespace handling float() does on its own.
+    values += [chr(i) + "1" for i in range(0x3000)]
+    values += ["1" + chr(i) for i in range(0x3000)]
+    return values
+
+
+def outcome(classify, value: Any) -> tuple[Any, str]:
+    try:
+        return classify(value)
+    except Exception as e:
+        return type(e), "error"
+
+
+def same(a: tuple[Any, str], b: tuple[Any, str]) -> bool:
+    if a[1] != b[1] or type(a[0]) != type(b[0]):
+        return False
+    if isinstance(a[0], float) and math.isnan(a[0]):
+        return math.isnan(b[0])
+    return a[0] == b[0]
+
+
+@pytest.mark.parametrize("value", CORPUS, ids=repr)
+def test_corpus_matches_reference(value):
+    assert same(outcome(classify_value, value), outcome(reference_classify, value))
+
+
+def test_fuzz_matches_reference():
+    mismatches = [
+        value for value in fuzz_corpus()
+        if not same(outcome(classify_value, value), outcome(reference_classify, value))
+    ]
+    assert mismatches == []
+
+
+@pytest.mark.parametrize("hint", [None, "number", "boolean", "datetime", "string"])
+def test_hinted_matches_unhinted(hint):
+    mismatches = [
+        value for value in CORPUS + fuzz_corpus()[:2000]
+        if not same(outcome(lambda v: classify_hinted(v, hint), value), outcome(classify_value, value))
+    ]
+    assert mismatches == []
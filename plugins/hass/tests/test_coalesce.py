@@ -0,0 +1,73 @@
+import asyncio
+
+from hass.coalesce import EventCoalescer
+
+
+def state(entity_id: str, value: str) -> dict:
+    return {"entity_id": entity_id, "state": value, "attributes": {}}
+
+
+def changed(entity_id: str, old: str, new: str) -> dict:
+    return {"event_type": "state_changed", "data": {
+        "entity_id": entity_id, "old_state": state(entity_id, old), "new_state": state(entity_id, new)}}
+
+
+async def drain(coalescer: EventCoalescer) -> list[dict]:
+    events = []
+    while not coalescer.queue.empty():
+        events.append(coalescer.queue.get_nowait())
+    return events
+
+
+def test_window_keeps_latest_state_and_first_old_state():
+    async def run():
+        coalescer = EventCoalescer(window=0.05)
+        await coalescer.put(changed("sensor.t", "1", "2"))
+        await coalescer.put(changed("sensor.t", "2", "3"))
+        await coalescer.put(changed("sensor.t", "3", "4"))
+        assert await drain(coalescer) == []
+
+        e = await asyncio.wait_for(coalescer.get(), 1)
+        assert e["data"]["old_state"]["state"] == "1"
+        assert e["data"]["new_state"]["state"] == "4"
+        assert await drain(coalescer) == []
+        await coalescer.cancel()
+
+    asyncio.run(run())
+
+
+def test_domain_windows_and_bypass():
+    async def run():
+        coalescer = EventCoalescer(domain_windows={"sensor": 10}, bypass_states=["unavailable"])
+        assert coalescer.enabled
+        await coalescer.put(changed("light.a", "off", "on"))
+        await coalescer.put(changed("sensor.t", "1", "2"))
+        await coalescer.put(changed("sensor.u", "1", "unavailable"))
+        assert [e["data"]["entity_id"] for e in await drain(coalescer)] == ["light.a", "sensor.u"]
+        assert list(coalescer.pending.keys()) == ["sensor.t"]
+        await coalescer.cancel()
+
+    asyncio.run(run())
+
+
+def test_drop_oldest_counts_dropped():
+    async def run():
+        coalescer = EventCoalescer(queue_size=2, overflow="drop_oldest")
+        for i in range(4):
+            await coalescer.put(changed("light.a", str(i), str(i + 1)))
+        assert coalescer.dropped == 2
+        assert [e["data"]["new_state"]["state"] for e in await drain(coalescer)] == ["3", "4"]
+        await coalescer.cancel()
+
+    asyncio.run(run())
+
+
+def test_close_flushes_pending():
+    async def run():
+        coalescer = EventCoalescer(window=10)
+        await coalescer.put(changed("sensor.t", "1", "2"))
+        await coalescer.close()
+        assert (await coalescer.get())["data"]["new_state"]["state"] == "2"
+        assert await coalescer.get() == None
+
+    asyncio.run(run())
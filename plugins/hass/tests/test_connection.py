@@ -0,0 +1,52 @@
+import asyncio
+
+import pytest
+
+from hass.connection import HassConnectionManager
+
+
+class FakeClient:
+    def __init__(self):
+        self.closed = False
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeManager(HassConnectionManager):
+    def __init__(self, fail: int = None, stall: int = None):
+        super().__init__("ws://test", "token", pool_size=2)
+        self.fail = fail
+        self.stall = stall
+        self.opened: list[FakeClient] = []
+
+    async def _open(self) -> FakeClient:
+        index = len(self.opened)
+        client = FakeClient()
+        self.opened.append(client)
+        if index == self.fail:
+            raise ConnectionError("refused")
+        if index == self.stall:
+            await asyncio.sleep(60)
+        return client
+
+
+def test_failed_connect_closes_opened_clients():
+    manager = FakeManager(fail=1)
+    with pytest.raises(ConnectionError):
+        asyncio.run(manager.connect())
+    assert [i.closed for i in manager.opened] == [True, False, True]
+
+
+def test_cancelled_connect_closes_opened_clients():
+    manager = FakeManager(stall=2)
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(asyncio.wait_for(manager.connect(), 0.05))
+    assert [i.closed for i in manager.opened] == [True, True, False]
+    assert manager.commands == []
+
+
+def test_request_without_connections():
+    manager = FakeManager()
+    with pytest.raises(ConnectionError, match="Not connected"):
+        asyncio.run(manager.fetch_states())
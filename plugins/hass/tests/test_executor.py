@@ -0,0 +1,34 @@
+import asyncio
+
+from hass.executor import TransformExecutor, transform_entities
+from hass.metrics import Histogram, metrics
+
+
+def state(entity_id: str, value) -> dict:
+    return {"entity_id": entity_id, "state": value, "attributes": {"friendly_name": entity_id}}
+
+
+def test_histogram_merge():
+    a, b = Histogram(), Histogram()
+    a.observe(0.001)
+    b.observe(0.002)
+    b.observe(0.0005)
+    a.merge(b)
+    a.merge(Histogram())
+    assert (a.count, a.min, a.max) == (3, 0.0005, 0.002)
+
+
+def test_process_mode_keeps_transform_metrics():
+    enabled = metrics.enabled
+    metrics.enabled = True
+    metrics.reset()
+    executor = TransformExecutor(mode="process", chunk_size=2, workers=1)
+    try:
+        states = [state("light." + str(i), "on") for i in range(5)]
+        entities = asyncio.run(executor.map(transform_entities, states))
+        assert [i.id for i in entities] == [i["entity_id"] for i in states]
+        assert metrics.histograms["transform.entity"].count == 5
+    finally:
+        executor.close()
+        metrics.enabled = enabled
+        metrics.reset()
@@ -0,0 +1,95 @@
+import asyncio
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+from hass.filters import EventFilter
+from hass.hub import HassHub
+
+
+def state(entity_id: str, value: str, second: int) -> dict:
+    return {"entity_id": entity_id, "state": value, "attributes": {},
+            "last_updated": f"2026-01-01T00:00:{second:02d}+00:00", "context": {"id": value}}
+
+
+def changed(entity_id: str, value: str, second: int) -> dict:
+    return {"event_type": "state_changed", "time_fired": None, "data": {
+        "entity_id": entity_id, "old_state": None, "new_state": state(entity_id, value, second)}}
+
+
+class FakeConnection:
+    # Stands in for HassConnectionManager. Each subscription replays one
+    # scripted session, a session ending in an exception drops the stream.
+    def __init__(self, states: list[dict], sessions: list[list]):
+        self.states = states
+        self.sessions = sessions
+        self.commands = [object()]
+        self.reconnects = 0
+
+    async def fetch_states(self):
+        return SimpleNamespace(success=True, data=list(self.states))
+
+    async def reconnect_events(self):
+        self.reconnects += 1
+
+    async def close(self):
+        pass
+
+    @asynccontextmanager
+    async def listen_event(self, event_type: str = None):
+        session = self.sessions.pop(0)
+
+        async def events():
+            for item in session:
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+            await asyncio.Event().wait()
+
+        yield events()
+
+
+def test_events_reconnect_and_resync():
+    async def run():
+        hub = HassHub("", "ws://hass", "token", reconnect=True, reconnect_delay=0, reconnect_max_delay=0)
+        hub.client = FakeConnection(
+            [state("sensor.a", "1", 0), state("sensor.b", "1", 0)],
+            [
+                [changed("sensor.a", "2", 1), ConnectionError("dropped")],
+                [changed("sensor.a", "4", 4)],
+            ],
+        )
+        await hub.resync()
+
+        # Changed while the stream was down.
+        hub.client.states = [state("sensor.a", "2", 1), state("sensor.b", "3", 3)]
+
+        stream = hub.events(EventFilter([], [], []))
+        received = [await asyncio.wait_for(anext(stream), 1) for _ in range(3)]
+        await stream.aclose()
+
+        assert hub.client.reconnects == 1
+        summary = [(e["data"]["entity_id"], e["data"]["new_state"]["state"], e.get("origin")) for e in received]
+        assert summary[0] == ("sensor.a", "2", None)
+        # The resync diff and live events after it arrive in either order.
+        assert sorted(summary[1:]) == [("sensor.a", "4", None), ("sensor.b", "3", "RESYNC")]
+        assert hub.mirror.states["sensor.a"]["state"] == "4"
+        assert hub.mirror.states["sensor.b"]["state"] == "3"
+
+    asyncio.run(run())
+
+
+def test_events_end_without_reconnect():
+    async def run():
+        hub = HassHub("", "ws://hass", "token")
+        hub.client = FakeConnection([], [[ConnectionError("dropped")]])
+        await hub.resync()
+
+        stream = hub.events(EventFilter([], [], []))
+        try:
+            await anext(stream)
+        except ConnectionError:
+            pass
+        else:
+            raise AssertionError("stream did not fail")
+
+    asyncio.run(run())
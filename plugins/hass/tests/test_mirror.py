@@ -0,0 +1,133 @@
+import pytest
+
+from hass.mirror import StateMirror
+
+
+def state(entity_id: str, value: str, second: int = 0, **attributes) -> dict:
+    return {"entity_id": entity_id, "state": value, "attributes": attributes,
+            "last_updated": f"2026-01-01T00:00:{second:02d}+00:00", "context": {"id": value + str(second)}}
+
+
+def test_get_serves_loaded_states():
+    mirror = StateMirror()
+    assert mirror.stale
+    mirror.load([state("light.a", "on", friendly_name="Lamp"), state("sensor.t", "21")])
+    assert mirror.loaded and not mirror.stale
+
+    assert [i.id for i in mirror.get()] == ["light.a", "sensor.t"]
+    assert [i.id for i in mirror.get(["sensor.t", "missing", "sensor.t"])] == ["sensor.t"]
+    assert mirror.get(["light.a"])[0].display.label == "Lamp"
+
+
+def test_transforms_are_cached_until_the_state_changes():
+    mirror = StateMirror()
+    mirror.load([state("light.a", "on"), state("light.b", "off")])
+    first = mirror.entity("light.a")
+    assert mirror.entity("light.a") is first
+
+    mirror.update(state("light.a", "off", 1))
+    assert mirror.entity("light.a") is not first
+    assert mirror.entity("light.a").properties["light.a.state"].value == False
+
+    # A resync keeps entities whose state did not change.
+    unchanged = mirror.entity("light.b")
+    mirror.load([mirror.states["light.a"], state("light.b", "off")])
+    assert mirror.entities.get("light.b") is unchanged
+
+
+def test_cache_ignores_outdated_entities():
+    mirror = StateMirror()
+    old = state("light.a", "on")
+    mirror.load([old])
+    mirror.update(state("light.a", "off", 1))
+    mirror.cache(old, mirror.entity("light.a", cache=False))
+    assert not "light.a" in mirror.entities
+
+
+def test_remove():
+    mirror = StateMirror()
+    mirror.load([state("light.a", "on")])
+    mirror.entity("light.a")
+    mirror.remove("light.a")
+    assert mirror.get() == []
+    assert mirror.entity("light.a") == None
+
+
+def test_stale_after_resync_interval():
+    mirror = StateMirror(resync_interval=60)
+    mirror.load([])
+    assert not mirror.stale
+    mirror.synced_at -= 61
+    assert mirror.stale
+
+
+def test_namespace_prefixes_ids():
+    mirror = StateMirror(namespace="north:")
+    mirror.load([state("light.a", "on")])
+    entity = mirror.entity("light.a")
+    assert entity.id == "north:light.a"
+    assert "north:light.a.state" in entity.properties
+
+
+def test_resync_keeps_states_newer_than_the_fetch():
+    mirror = StateMirror()
+    mirror.load([state("light.a", "off", 1), state("light.b", "on", 1)])
+    mirror.begin_sync()
+    # Live events that arrived while the fetch was in flight.
+    mirror.update(state("light.a", "on", 5))
+    mirror.update(state("light.c", "on", 5))
+    mirror.remove("light.b")
+    fetched = [state("light.a", "off", 1), state("light.b", "on", 1)]
+
+    assert mirror.diff(fetched) == []
+    mirror.load(fetched)
+    mirror.end_sync()
+    assert {k: v["state"] for k, v in mirror.states.items()} == {"light.a": "on", "light.c": "on"}
+
+
+def test_resync_applies_newer_fetched_states():
+    mirror = StateMirror()
+    mirror.load([state("light.a", "off", 1), state("light.b", "on", 1)])
+    fetched = [state("light.a", "on", 2)]
+
+    events = mirror.diff(fetched)
+    assert [(e["data"]["entity_id"], e["data"]["new_state"] and e["data"]["new_state"]["state"]) for e in events] == [
+        ("light.a", "on"), ("light.b", None)]
+    assert all([e["origin"] == "RESYNC" for e in events])
+    mirror.load(fetched)
+    assert list(mirror.states.keys()) == ["light.a"]
+
+
+def test_outdated():
+    mirror = StateMirror()
+    mirror.load([state("light.a", "on", 5)])
+    assert mirror.outdated(state("light.a", "off", 1))
+    assert mirror.outdated(state("light.a", "on", 5))
+    assert not mirror.outdated(state("light.a", "off", 6))
+    assert not mirror.outdated(state("light.b", "off", 1))
+
+
+def test_query_indexes():
+    mirror = StateMirror()
+    mirror.load([
+        state("sensor.t", "21", unit_of_measurement="°C", device_class="temperature"),
+        state("sensor.h", "40", unit_of_measurement="%", device_class="humidity"),
+        state("light.a", "on"),
+    ])
+    assert mirror.query(domain="sensor") == ["sensor.h", "sensor.t"]
+    assert mirror.query(domain="sensor", unit="°C") == ["sensor.t"]
+    assert mirror.query(device_class=["temperature", "humidity"]) == ["sensor.h", "sensor.t"]
+    assert mirror.query(domain=None) == ["sensor.t", "sensor.h", "light.a"]
+    with pytest.raises(KeyError):
+        mirror.query(area="kitchen")
+
+
+def test_query_indexes_follow_updates():
+    mirror = StateMirror()
+    mirror.load([state("light.a", "on"), state("light.b", "off")])
+    assert mirror.query(state="on") == ["light.a"]
+    mirror.update(state("light.b", "on", 1))
+    assert mirror.query(state="on") == ["light.a", "light.b"]
+    mirror.remove("light.a")
+    assert mirror.query(state="on") == ["light.b"]
+    assert mirror.query(domain="light", state="off") == []
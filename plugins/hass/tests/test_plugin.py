@@ -0,0 +1,187 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+import pytest
+import yaml
+from haus_utils import PluginConfig
+from pydantic import ValidationError
+
+from hass import HassPlugin, HassPluginSettings
+
+MANIFEST = os.path.join(os.path.dirname(__file__), "..", "plugin.yaml")
+
+
+def make_plugin(**settings) -> HassPlugin:
+    with open(MANIFEST) as f:
+        config = PluginConfig(**yaml.safe_load(f))
+    return HassPlugin(config, settings)
+
+
+def state(entity_id: str, value: str) -> dict:
+    return {"entity_id": entity_id, "state": value, "attributes": {},
+            "last_updated": "2026-01-01T00:00:00+00:00", "context": {"id": value}}
+
+
+@pytest.mark.parametrize("server, token, expected", [
+    ("wss://hass", "t", {"": ("wss://hass", "t")}),
+    ("ws://hass/api?a=b", "t", {"": ("ws://hass/api?a=b", "t")}),
+    ("north=wss://n, south=wss://s", "t", {"north": ("wss://n", "t"), "south": ("wss://s", "t")}),
+    ("north=wss://n,south=wss://s", "north=a, south=b", {"north": ("wss://n", "a"), "south": ("wss://s", "b")}),
+])
+def test_servers(server, token, expected):
+    assert HassPluginSettings(hass_server=server, hass_token=token).servers() == expected
+
+
+@pytest.mark.parametrize("server, token", [
+    ("", "t"),
+    ("wss://a,wss://b", "t"),
+    ("north=wss://n,wss://s", "t"),
+    ("north=wss://n,north=wss://s", "t"),
+    ("north=wss://n,south=wss://s", "north=a"),
+])
+def test_invalid_servers(server, token):
+    with pytest.raises(ValidationError):
+        HassPluginSettings(hass_server=server, hass_token=token)
+
+
+def test_single_server_is_not_namespaced():
+    plugin = make_plugin(hass_server="wss://hass", hass_token="t")
+    assert not plugin.namespaced
+    hub, local = plugin._route("light.a")
+    assert hub is plugin.hubs[""] and local == "light.a"
+
+
+def test_routing_by_namespace():
+    plugin = make_plugin(hass_server="north=wss://n,south=wss://s", hass_token="t")
+    north, south = plugin.hubs["north"], plugin.hubs["south"]
+    assert plugin.namespaced
+    assert north.namespace == "north:"
+    assert plugin._route("south:light.a") == (south, "light.a")
+    assert plugin._route("west:light.a")[0] == None
+    assert plugin._route("light.a")[0] == None
+    assert plugin._group(["north:light.a", "south:light.b", "north:light.c", "light.d"]) == {
+        north: ["light.a", "light.c"], south: ["light.b"]}
+    assert plugin._group(None) == {north: None, south: None}
+
+
+def test_get_entities_fans_in():
+    async def run():
+        plugin = make_plugin(hass_server="north=wss://n,south=wss://s", hass_token="t")
+        plugin.hubs["north"].mirror.load([state("light.a", "on")])
+        plugin.hubs["south"].mirror.load([state("light.a", "off"), state("light.b", "on")])
+
+        assert sorted([i.id for i in await plugin.get_entities()]) == [
+            "north:light.a", "south:light.a", "south:light.b"]
+        assert [i.id for i in await plugin.get_entities(["south:light.b", "west:light.a"])] == ["south:light.b"]
+
+    asyncio.run(run())
+
+
+class FakeCommands:
+    def __init__(self):
+        self.calls = []
+
+    async def call_service(self, domain: str, service: str, target: dict = None, data: dict = None):
+        self.calls.append((domain + "." + service, target, data))
+        return SimpleNamespace(success=True, data=None)
+
+
+def test_call_actions_reports_errors_per_call():
+    async def run():
+        plugin = make_plugin(hass_server="wss://hass", hass_token="t")
+        plugin.hubs[""].client = FakeCommands()
+        results = await plugin.call_actions([
+            {"action_id": "light.toggle", "target": "light.a"},
+            {"target": "light.b"},
+            {"action_id": "light.toggle", "target": "light.a"},
+        ])
+
+        assert [(i.action_id, i.target, i.success) for i in results] == [
+            ("light.toggle", "light.a", True),
+            ("", "light.b", False),
+            ("light.toggle", "light.a", True),
+        ]
+        assert results[1].error
+        assert plugin.hubs[""].client.calls == [
+            ("light.toggle", {"entity_id": ["light.a"]}, {}),
+            ("light.toggle", {"entity_id": ["light.a"]}, {}),
+        ]
+
+    asyncio.run(run())
+
+
+def test_calls_before_connecting_fail_clearly():
+    async def run():
+        plugin = make_plugin(hass_server="wss://hass", hass_token="t")
+        with pytest.raises(ConnectionError):
+            await plugin.call_action("light.toggle", "light.a", {})
+        results = await plugin.call_actions([{"action_id": "light.toggle", "target": "light.a"}])
+        assert not results[0].success and "Not connected" in results[0].error
+
+    asyncio.run(run())
+
+
+def test_rename_emits_delta_event():
+    plugin = make_plugin(hass_server="wss://hass", hass_token="t", delta_events=True)
+    old = state("light.a", "on")
+    new = dict(state("light.a", "on"), attributes={"friendly_name": "Porch"})
+    event = plugin._plugin_event(plugin.hubs[""], {
+        "event_type": "state_changed", "time_fired": None,
+        "data": {"entity_id": "light.a", "old_state": old, "new_state": new}})
+    assert event.types == ["state_changed", "delta"]
+    assert event.data["changed"] == [] and event.data["display"]
+    assert event.new_state.display.label == "Porch"
+
+    # Nothing visible changed.
+    assert plugin._plugin_event(plugin.hubs[""], {
+        "event_type": "state_changed", "time_fired": None,
+        "data": {"entity_id": "light.a", "old_state": new, "new_state": dict(new)}}) == None
+
+
+class FakeEvents:
+    def __init__(self):
+        self.queue = asyncio.Queue()
+
+    @asynccontextmanager
+    async def listen_event(self, event_type: str = None):
+        async def events():
+            while True:
+                yield await self.queue.get()
+
+        yield events()
+
+    async def close(self):
+        pass
+
+
+def changed(entity_id: str, value: str) -> dict:
+    return {"event_type": "state_changed", "time_fired": None, "data": {
+        "entity_id": entity_id, "old_state": None, "new_state": state(entity_id, value)}}
+
+
+def test_stalled_listener_does_not_stall_the_mirror():
+    async def run():
+        plugin = make_plugin(hass_server="wss://hass", hass_token="t", replay_buffer_size="5")
+        hub = plugin.hubs[""]
+        hub.client = FakeEvents()
+        hub.mirror.load([state("sensor.t", "0")])
+
+        listener = plugin.listen_events()
+        hub.client.queue.put_nowait(changed("sensor.t", "1"))
+        assert (await asyncio.wait_for(anext(listener), 1)).new_state.id == "sensor.t"
+
+        # The listener stops reading while changes keep coming in.
+        for i in range(2, 22):
+            hub.client.queue.put_nowait(changed("sensor.t", str(i)))
+        await asyncio.sleep(0.05)
+        assert hub.mirror.states["sensor.t"]["state"] == "21"
+        assert (await plugin.get_entities(["sensor.t"]))[0].properties["sensor.t.state"].value == 21
+
+        # It fell behind the buffer, so it is resynced when it resumes.
+        assert (await asyncio.wait_for(anext(listener), 1)).types == ["resync"]
+        await listener.aclose()
+        await plugin.close()
+
+    asyncio.run(run())
@@ -0,0 +1,69 @@
+import asyncio
+
+from haus_utils import PluginEvent
+
+from hass.replay import EventLog
+
+
+def event() -> PluginEvent:
+    return PluginEvent(id="", plugin="hass", types=["state"], data={}, targets=[], new_state=None)
+
+
+def test_ids_carry_the_epoch():
+    log = EventLog(size=4)
+    log.append(event())
+    sequence = log.append(event())
+    assert sequence == 2
+    assert log.events[-1][0].id == log.id(2)
+    assert log.position(log.id(2)) == 2
+    assert log.position(EventLog().id(2)) == None
+    assert log.position("2") == None
+    assert log.position("garbage") == None
+
+
+def test_read_returns_events_after_cursor():
+    log = EventLog(size=4)
+    for _ in range(3):
+        log.append(event(), 10.0)
+    reader = log.subscribe(1)
+    assert [(sequence, e.id, fired) for sequence, e, fired in log.read(reader)] == [
+        (2, log.id(2), 10.0), (3, log.id(3), 10.0)]
+    assert log.backlog() == 2
+    log.ack(reader, 3)
+    assert log.read(reader) == []
+    assert log.backlog() == 0
+
+
+def test_evicted_cursor_reads_none():
+    log = EventLog(size=2)
+    reader = log.subscribe(0)
+    for _ in range(3):
+        log.append(event())
+    assert log.first == 2
+    assert not log.covers(0)
+    assert log.read(reader) == None
+
+
+def test_slow_reader_never_holds_the_writer():
+    log = EventLog(size=2)
+    reader = log.subscribe(0)
+    for _ in range(5):
+        log.append(event())
+    assert log.sequence == 5
+    assert log.backlog() == 5
+    assert log.read(reader) == None
+    log.seek(reader, log.sequence)
+    assert log.read(reader) == []
+
+
+def test_close_wakes_waiters():
+    async def run():
+        log = EventLog()
+        waiter = asyncio.create_task(log.wait())
+        await asyncio.sleep(0)
+        error = ConnectionError("gone")
+        log.close(error)
+        await asyncio.wait_for(waiter, 1)
+        assert log.closed and log.error is error
+
+    asyncio.run(run())
@@ -0,0 +1,50 @@
+import pickle
+
+from hass.catalog import ActionCatalog
+from hass.snapshot import Snapshot
+
+
+def state(entity_id: str, value: str) -> dict:
+    return {"entity_id": entity_id, "state": value, "attributes": {},
+            "last_updated": "2026-01-01T00:00:00+00:00", "context": {"id": value}}
+
+
+def make_snapshot() -> Snapshot:
+    catalog = ActionCatalog()
+    catalog.load({"light": {"turn_on": {"name": "", "description": "", "fields": {}}}})
+    return Snapshot([state("light.a", "on")], dict(catalog.services), dict(catalog.actions))
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "snapshots" / "hass.snapshot")
+    snapshot = make_snapshot()
+    snapshot.save(path, "wss://hass", "north:")
+
+    loaded = Snapshot.load(path, "wss://hass", "north:")
+    assert loaded.states == snapshot.states
+    assert loaded.services == snapshot.services
+    assert loaded.actions == snapshot.actions
+
+
+def test_rejects_other_servers(tmp_path):
+    path = str(tmp_path / "hass.snapshot")
+    make_snapshot().save(path, "wss://hass", "")
+    assert Snapshot.load(path, "wss://other", "") == None
+    assert Snapshot.load(path, "wss://hass", "north:") == None
+
+
+def test_rejects_other_library_versions(tmp_path):
+    path = str(tmp_path / "hass.snapshot")
+    header = Snapshot.header("wss://hass")
+    header["libraries"] = {**header["libraries"], "pydantic": "0.0.0"}
+    with open(path, "wb") as f:
+        f.write(pickle.dumps(header) + pickle.dumps({"states": [], "services": {}, "actions": {}}))
+    assert Snapshot.load(path, "wss://hass") == None
+
+
+def test_missing_or_corrupt(tmp_path):
+    path = str(tmp_path / "hass.snapshot")
+    assert Snapshot.load(path, "wss://hass") == None
+    with open(path, "wb") as f:
+        f.write(b"not a snapshot")
+    assert Snapshot.load(path, "wss://hass") == None
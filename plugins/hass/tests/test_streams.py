@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+from hass.streams import fair_merge, merge_streams
+
+
+async def items(*values, error: Exception = None):
+    for value in values:
+        yield value
+    if error:
+        raise error
+
+
+async def forever():
+    while True:
+        await asyncio.sleep(1)
+        yield None
+
+
+async def collect(stream) -> list:
+    return [i async for i in stream]
+
+
+def test_merge_streams_interleaves_sources():
+    async def run():
+        merged = await collect(merge_streams(items(1, 2), items(3, 4)))
+        assert sorted(merged) == [1, 2, 3, 4]
+
+    asyncio.run(run())
+
+
+def test_merge_streams_raises_source_errors():
+    async def run():
+        with pytest.raises(ConnectionError):
+            await collect(merge_streams(items(1, error=ConnectionError()), forever()))
+
+    asyncio.run(run())
+
+
+def test_merge_streams_auxiliary_does_not_keep_alive():
+    async def run():
+        merged = await asyncio.wait_for(collect(merge_streams(items(1, 2), auxiliary=[forever()])), 1)
+        assert merged == [1, 2]
+
+    asyncio.run(run())
+
+
+def test_fair_merge_takes_turns():
+    async def run():
+        burst = items(*["a"] * 6)
+        quiet = items("b", "b")
+        merged = await collect(fair_merge(burst, quiet))
+        assert sorted(merged) == ["a"] * 6 + ["b"] * 2
+        # Both b arrive before the burst is over.
+        assert merged.index("b", merged.index("b") + 1) < 5
+
+    asyncio.run(run())
+
+
+def test_fair_merge_raises_after_others_end():
+    async def run():
+        merged = []
+        with pytest.raises(ConnectionError):
+            async for i in fair_merge(items(1, error=ConnectionError()), items(2, 3, 4)):
+                merged.append(i)
+        assert sorted(merged) == [1, 2, 3, 4]
+
+    asyncio.run(run())
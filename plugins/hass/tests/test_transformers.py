@@ -0,0 +1,53 @@
+import pytest
+
+from hass.transformers import EntityTransformer
+
+
+@pytest.fixture(autouse=True)
+def plans():
+    size = EntityTransformer.PLAN_CACHE_SIZE
+    EntityTransformer._plans.clear()
+    yield EntityTransformer._plans
+    EntityTransformer._plans.clear()
+    EntityTransformer.PLAN_CACHE_SIZE = size
+
+
+def state(entity_id: str, value, **attributes) -> dict:
+    return {"entity_id": entity_id, "state": value, "attributes": attributes}
+
+
+def test_plan_is_reused_until_keys_change(plans):
+    EntityTransformer.transform(state("sensor.t", "21", unit_of_measurement="°C"))
+    plan = plans["sensor.t"][1]
+    assert plan["state"].value_type == "number"
+
+    EntityTransformer.transform(state("sensor.t", "22", unit_of_measurement="°C"))
+    assert plans["sensor.t"][1] is plan
+
+    # A new key set gets a new plan that keeps the surviving steps.
+    EntityTransformer.transform(state("sensor.t", "23", unit_of_measurement="°C", battery=90))
+    assert plans["sensor.t"][1] is not plan
+    assert plans["sensor.t"][1]["state"] is plan["state"]
+
+
+def test_plans_are_evicted_least_recently_used(plans):
+    EntityTransformer.PLAN_CACHE_SIZE = 2
+    for entity_id in ["light.a", "light.b", "light.a", "light.c"]:
+        EntityTransformer.transform(state(entity_id, "on"))
+    assert list(plans.keys()) == ["light.a", "light.c"]
+
+
+def test_forget(plans):
+    EntityTransformer.transform(state("light.a", "on"))
+    EntityTransformer.forget("light.a")
+    EntityTransformer.forget("light.b")
+    assert len(plans) == 0
+
+
+def test_type_hint_does_not_change_results():
+    entity = EntityTransformer.transform(state("sensor.t", "21"))
+    assert entity.properties["sensor.t.state"].value == 21.0
+    # Was a number, now a boolean, a string and a number again.
+    for value, expected in [("on", True), ("unavailable", "unavailable"), ("5", 5.0)]:
+        entity = EntityTransformer.transform(state("sensor.t", value))
+        assert entity.properties["sensor.t.state"].value == expected